@@ -1,93 +1,62 @@
 import os.path
 import logging
+import numpy as np
 import pyogg
-from svglib.svglib import svg2rlg
-from reportlab.graphics import renderPDF
+from reportlab.pdfgen import canvas
 
-base_file_start = r'<?xml version="1.0" encoding="UTF-8"?>' + '\n' + \
-                r'<!DOCTYPE svg PUBLIC "-//W3C//DRD SVG 1.1//EN" ' \
-                r'"http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">' + '\n' + \
-                r'<svg xmlns="http://www.w3.org/2000/svg"' + '\n' + \
-                r'xmlns:xlink="http://www.w3.org/1999/xlink"' + '\n' + \
-                r'xmlns:ev="http://www.w3.org/2001/xml-events" version="1.1"' + '\n' + \
-                r'width="600" ' + '\n' + \
-                r'height="100" ' + '\n' + \
-                r'>'
-base_file_end = r'</svg>'
+graph_width = 600
+graph_height = 100
 
-x_placeholder = 'X_VAL'
-y_placeholder = 'Y_VAL'
-h_placeholder = 'H_VAL'
-w_placeholder = 'W_VAL'
-box_template = r'<rect ' \
-                r'y="' + y_placeholder + r'" '\
-                r'x="' + x_placeholder + r'" '\
-                r'height="' + h_placeholder + '" ' \
-                r'width="' + w_placeholder + '" ' \
-                r'style="fill:rgb(255,255,255)"/>'
 
+def create_graph(y_values, target, bar_ratio=.6):
+    # Draws the bars of the waveform straight into a PDF file.
+    y_values = np.asarray(y_values, dtype=np.float64)
+    m = y_values.max() if y_values.size else 0
+    if m > 0:
+        scaled_y_values = graph_height * y_values / m
+    else:
+        scaled_y_values = np.zeros_like(y_values)
+    scaled_y_values = np.maximum(scaled_y_values, graph_height / 10)
+
+    step = graph_width / max(len(scaled_y_values), 1)
+    bar_width = step * bar_ratio
 
-def create_graph(y_values, target):
-    scaled_y_values = []
-    for y in y_values:
-        m = max(y_values)
-        scaled_y = (int(100 * y / m))
-        scaled_y = scaled_y - scaled_y % 10
-        scaled_y = max(scaled_y, 10)
-        scaled_y_values.append(scaled_y)
+    c = canvas.Canvas(target, pagesize=(graph_width, graph_height), invariant=1, pageCompression=1)
+    c.setFillColorRGB(1, 1, 1)
+    for i, h in enumerate(scaled_y_values.tolist()):
+        c.roundRect(i * step, 0, bar_width, h, bar_width / 2, stroke=0, fill=1)
+    c.showPage()
+    c.save()
 
-    file_content = base_file_start
-    for i in range(len(scaled_y_values)):
-        curr_box = box_template.replace(x_placeholder, str(i * 20))
-        curr_box = curr_box.replace(y_placeholder, str(100 - scaled_y_values[i]))
-        curr_box = curr_box.replace(h_placeholder, str(scaled_y_values[i]))
-        curr_box = curr_box.replace(w_placeholder, '10')
-        file_content += curr_box + '\n'
 
-    file_content += base_file_end
+def envelope(samples, target_amount=30, mode='rms'):
+    # Splits the samples into target_amount buckets and returns the loudness of each bucket, either as root mean
+    # square or as peak value. Multiple channels are treated as one.
+    samples = np.asarray(samples, dtype=np.float32)
+    samples = samples.reshape(samples.shape[0], -1)
+    n = samples.shape[0] - samples.shape[0] % target_amount
+    if n == 0:
+        return np.zeros(target_amount)
 
-    with open(target, 'w') as f:
-        f.write(file_content)
+    buckets = samples[:n].reshape(target_amount, -1)
+    if mode == 'peak':
+        return np.abs(buckets).max(axis=1)
+    return np.sqrt(np.mean(np.square(buckets), axis=1, dtype=np.float64))
 
 
-def get_ogg_values(path, target_amount=30):
+def get_ogg_values(path, target_amount=30, mode='rms'):
     opus_file = pyogg.OpusFile(path)
     buf = opus_file.as_array()
-    n = buf.shape[0]
-    step_size = int(n / target_amount)
-
-    value_list = []
-    for i in range(target_amount):
-        value_list.append(int(buf[i * step_size]))
-
-    return value_list
-
-
-def svg_to_pdf(svg_path, delete=True):
-    dirname, fname = os.path.split(svg_path)
-
-    if fname.endswith('.svg'):
-        pdf_path = os.path.join(dirname, fname[:-4] + '.pdf')
-    else:
-        pdf_path = os.path.join(dirname, fname + '.pdf')
-
-    drawing = svg2rlg(svg_path)
-    renderPDF.drawToFile(drawing, pdf_path)
-
-    if delete:
-        os.remove(svg_path)
-
-    return pdf_path
+    return envelope(buf, target_amount, mode)
 
 
-def ogg_to_pdf(source_path, target_path):
+def ogg_to_pdf(source_path, target_path, target_amount=30, mode='rms'):
     if source_path.endswith('.ogg'):
         dirname, fname = os.path.split(source_path)
-        v = get_ogg_values(source_path)
-        nfn = fname[:-3] + 'svg'
-        full_target_path = os.path.join(target_path, nfn)
+        v = get_ogg_values(source_path, target_amount, mode)
+        full_target_path = os.path.join(target_path, fname[:-3] + 'pdf')
         create_graph(v, full_target_path)
-        return svg_to_pdf(full_target_path, True)
+        return full_target_path
     else:
-        logging.error('{} is not an OGG file')
+        logging.error('{} is not an OGG file'.format(source_path))
         return None
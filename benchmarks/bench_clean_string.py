@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Compares BubbleCreator.clean_string_for_tex with the previous implementation, which looped over every emoji in
+# emoji-codes.json for every string, on a synthetic emoji-heavy corpus.
+#
+# Usage: python benchmarks/bench_clean_string.py [-n MESSAGES] [--emoji-ratio RATIO]
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_path)
+
+from bubblecreator import BubbleCreator  # noqa: E402
+
+
+def legacy_clean_string_for_tex(bc, input_string):
+    output_string = input_string
+
+    # replace emojis with images
+    for emoji_character in bc.emoji_data.keys():
+        # check if string contains current emoji
+        if emoji_character in output_string:
+            # check if we have that emoji as an image file
+            file_name = os.path.join(bc.emoji_images_path,
+                                     bc.emoji_data[emoji_character].replace('+', '').replace('U', 'u').replace(' ', ''))
+            if os.path.isfile(file_name + '.png') or os.path.isfile(file_name + '.pdf'):
+                output_string = output_string.replace(emoji_character, bc.tex_cmd_emoji(bc.emoji_data[emoji_character]))
+            else:
+                output_string = '(emoji picture missing: {})'.format(file_name)
+
+    # replace latex symbols with escaped symbols
+    latex_bad = {
+        '_': r'\_',
+        '^': r'\^{}',
+        '℃': r'$^{\circ}$C',
+        '"': "``",
+        '#': r'\#',
+        '%': r'\%',
+        '\ufe0f': '',
+        '\u1f3fe': '',
+        '&': r'\&'
+    }
+    for emoji_character in latex_bad.keys():
+        output_string = output_string.replace(emoji_character, latex_bad[emoji_character])
+
+    return output_string
+
+
+def make_corpus(emojis, amount, emoji_ratio, seed=0):
+    rnd = random.Random(seed)
+    words = ['hello', 'see', 'you', 'tomorrow', 'at', '8', 'o\'clock', 'price_tag', '100%', 'Tom & Jerry', '#tag',
+             '"quoted"', 'x^2', 'ok', 'lol', 'what', 'the', 'weather', 'is', 'nice']
+    corpus = []
+    for _ in range(amount):
+        tokens = []
+        for _ in range(rnd.randint(3, 30)):
+            if rnd.random() < emoji_ratio:
+                tokens.append(rnd.choice(emojis))
+            else:
+                tokens.append(rnd.choice(words))
+        corpus.append(' '.join(tokens))
+    return corpus
+
+
+def measure(function, corpus):
+    start = time.perf_counter()
+    results = [function(s) for s in corpus]
+    return time.perf_counter() - start, results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Micro-benchmark for BubbleCreator.clean_string_for_tex.')
+    arg_parser.add_argument('-n', '--messages', type=int, default=5000, help='Number of synthetic messages')
+    arg_parser.add_argument('--emoji-ratio', type=float, default=0.3, help='Share of tokens that are emojis')
+    args = arg_parser.parse_args()
+
+    with open(os.path.join(repo_path, 'emoji-codes.json')) as ecf:
+        emoji_data = json.load(ecf)
+
+    # Only use emojis that do not overlap with another emoji sequence. For those, the previous implementation gave
+    # order dependent results, so the outputs could not be compared.
+    emojis = [e for e in emoji_data if not any(o != e and (e in o or o in e) for o in emoji_data)]
+    corpus = make_corpus(emojis, args.messages, args.emoji_ratio)
+
+    with tempfile.TemporaryDirectory() as destination_path:
+        bc = BubbleCreator()
+        bc.destination_path = destination_path
+        bc.emoji_images_path = os.path.join(destination_path, 'emoji')
+        bc.emoji_data = emoji_data
+        os.mkdir(bc.emoji_images_path)
+        for code in emoji_data.values():
+            open(bc.emoji_file_name(code) + '.png', 'w').close()
+
+        start = time.perf_counter()
+        bc.prepare_tex_cleaning()
+        setup_time = time.perf_counter() - start
+
+        legacy_time, legacy_results = measure(lambda s: legacy_clean_string_for_tex(bc, s), corpus)
+        new_time, new_results = measure(bc.clean_string_for_tex, corpus)
+
+    mismatches = sum(1 for a, b in zip(legacy_results, new_results) if a != b)
+    print('{} messages, emoji ratio {}'.format(len(corpus), args.emoji_ratio))
+    print('legacy:      {:8.3f} s ({:10.0f} messages/s)'.format(legacy_time, len(corpus) / legacy_time))
+    print('single-pass: {:8.3f} s ({:10.0f} messages/s), pattern built in {:.3f} s'.format(
+        new_time, len(corpus) / new_time, setup_time))
+    print('speedup:     {:8.1f}x'.format(legacy_time / new_time))
+    print('mismatching outputs: {}'.format(mismatches))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
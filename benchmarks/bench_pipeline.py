@@ -0,0 +1,168 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Runs the conversion pipeline headlessly on a synthetic (or given) chat export and reports messages per second,
+# peak memory and the time spent in the individual stages.
+#
+# With --check, the chat is converted a second time with the messages rendered by this process only, and the LaTeX
+# files of both runs are compared byte by byte (e.g. to check --render-jobs against the serial rendering).
+#
+# Usage: python benchmarks/bench_pipeline.py [-n MESSAGES] [--export DIR] [--keep DIR] [--json FILE]
+#                                            [--render-jobs N] [--check] [mix options]
+
+import argparse
+import filecmp
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_path)
+
+from bubblecreator import BubbleCreator  # noqa: E402
+from jsonstream import iter_array  # noqa: E402
+from synthetic_export import ExportGenerator, add_mix_arguments, mix_from_arguments  # noqa: E402
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def compare_outputs(path, reference_path):
+    # Returns the LaTeX files and the manifest that differ between the two output folders or exist in only one.
+    names = set(n for n in os.listdir(path) if n.endswith('.tex')) | {'bc2-manifest.json'}
+    names |= set(n for n in os.listdir(reference_path) if n.endswith('.tex'))
+    return sorted(n for n in names if not os.path.isfile(os.path.join(path, n))
+                  or not os.path.isfile(os.path.join(reference_path, n))
+                  or not filecmp.cmp(os.path.join(path, n), os.path.join(reference_path, n), shallow=False))
+
+
+def run_benchmark(export_path, destination_path, args, render_jobs=None):
+    results = {'export': export_path, 'export_mb': os.path.getsize(os.path.join(export_path, 'result.json')) / 2 ** 20}
+
+    # reading only, as a baseline for the rest
+    start = time.perf_counter()
+    message_count = sum(1 for _ in iter_array(os.path.join(export_path, 'result.json')))
+    results['messages'] = message_count
+    results['read_seconds'] = time.perf_counter() - start
+
+    bc = BubbleCreator()
+    bc.data_path = export_path
+    bc.destination_path = destination_path
+    bc.template_path = os.path.join(repo_path, 'template')
+    bc.bg_path = None
+    bc.use_media_cache = not args.no_cache
+    bc.media.workers = args.jobs
+    bc.compile_jobs = args.jobs
+    bc.render_jobs = (args.render_jobs or None) if render_jobs is None else render_jobs
+
+    if not args.no_emoji_images:
+        # empty placeholder files are enough for the emoji lookup
+        emoji_path = os.path.join(destination_path, 'emoji')
+        os.makedirs(emoji_path, exist_ok=True)
+        with open(os.path.join(repo_path, 'emoji-codes.json')) as ecf:
+            for code in json.load(ecf).values():
+                open(os.path.join(emoji_path, code.replace('+', '').replace('U', 'u').replace(' ', '') + '.png'),
+                     'w').close()
+
+    # run() reads emoji-codes.json relative to the working directory
+    working_directory = os.getcwd()
+    os.chdir(repo_path)
+    try:
+        start = time.perf_counter()
+        bc.run(compile=args.compile)
+        results['run_seconds'] = time.perf_counter() - start
+    finally:
+        os.chdir(working_directory)
+
+    results['messages_per_second'] = message_count / results['run_seconds'] if results['run_seconds'] else None
+    results['peak_rss_mb'] = peak_rss_mb()
+    results['stages'] = bc.stats.report()
+    return results
+
+
+def print_results(results):
+    print()
+    print('Export:              {} ({} messages, {:.1f} MB)'.format(results['export'], results['messages'],
+                                                                   results['export_mb']))
+    print('Reading only:        {:8.2f} s ({:10.0f} messages/s)'.format(
+        results['read_seconds'], results['messages'] / results['read_seconds']))
+    print('Complete run:        {:8.2f} s ({:10.0f} messages/s)'.format(
+        results['run_seconds'], results['messages_per_second']))
+    print('Peak RSS:            {:8.1f} MB'.format(results['peak_rss_mb']))
+    print()
+    print('{:40} {:>10} {:>10}'.format('Stage', 'seconds', 'calls'))
+    for name, timer in results['stages']['timers'].items():
+        print('{:40} {:10.3f} {:10}'.format(name, timer['seconds'], timer['calls']))
+    print()
+    for name, value in results['stages']['counters'].items():
+        print('{:40} {:10}'.format(name, value))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Throughput benchmark for the conversion pipeline.')
+    arg_parser.add_argument('-n', '--messages', type=int, default=10000, help='Number of synthetic messages')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--export', help='Use this export directory instead of generating one')
+    arg_parser.add_argument('--keep', help='Keep the generated export and the output in this directory')
+    arg_parser.add_argument('--json', help='Also write the results to this JSON file')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=None, help='Worker processes for media and pdflatex')
+    arg_parser.add_argument('--render-jobs', type=int, default=1,
+                            help='Processes rendering the messages, 0 for one per CPU (default: 1)')
+    arg_parser.add_argument('--check', action='store_true',
+                            help='Also render the messages in this process only and compare the LaTeX files')
+    arg_parser.add_argument('-a', '--compile', action='store_true', help='Also run pdflatex')
+    arg_parser.add_argument('--no-cache', action='store_true', help='Disable the media cache')
+    arg_parser.add_argument('--no-emoji-images', action='store_true',
+                            help="Don't provide emoji images (tests the missing emoji path)")
+    arg_parser.add_argument('-v', '--verbose', action='store_true', help='Show warnings and errors of the pipeline')
+    add_mix_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    # failed media conversions are counted in the report anyway
+    logging.basicConfig(level=logging.WARNING if args.verbose else logging.CRITICAL)
+
+    work_path = args.keep or tempfile.mkdtemp(prefix='bc2-bench-')
+    try:
+        export_path = args.export
+        if export_path is None:
+            export_path = os.path.join(work_path, 'export')
+            start = time.perf_counter()
+            ExportGenerator(export_path, mix_from_arguments(args), args.seed).generate(args.messages)
+            print('Generated {} messages in {:.1f} s'.format(args.messages, time.perf_counter() - start))
+
+        output_path = os.path.join(work_path, 'output')
+        if args.check:
+            # the paths of the media are part of the LaTeX files, so both runs have to write to the same folder
+            reference = run_benchmark(export_path, output_path, args, render_jobs=1)
+            os.rename(output_path, output_path + '-serial')
+        results = run_benchmark(export_path, output_path, args)
+        print_results(results)
+        if args.check:
+            differences = compare_outputs(output_path, output_path + '-serial')
+            results['serial_run_seconds'] = reference['run_seconds']
+            results['differences'] = differences
+            print()
+            print('Serial rendering:    {:8.2f} s ({:10.0f} messages/s)'.format(
+                reference['run_seconds'], reference['messages_per_second']))
+            if differences:
+                print('Output differs from the serial rendering: ' + ', '.join(differences))
+            else:
+                print('Output is identical to the serial rendering.')
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=1)
+    finally:
+        if args.keep is None:
+            shutil.rmtree(work_path, ignore_errors=True)
+    return 1 if results.get('differences') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
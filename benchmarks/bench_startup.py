@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Measures how long it takes until the converter can start working: importing bubblecreator (in fresh processes),
+# loading the emoji table with and without its cache, and a complete run on a tiny text-only chat. Also lists which
+# heavy libraries are loaded by the import alone, they should only be loaded by the media converters that need them.
+#
+# Usage: python benchmarks/bench_startup.py [-r REPEAT] [--top N] [--json FILE]
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_path)
+
+from synthetic_export import ExportGenerator  # noqa: E402
+
+heavy_modules = ['numpy', 'pyogg', 'reportlab', 'PIL', 'webptools', 'av', 'svglib']
+
+
+def time_process(command, repeat, cwd=repo_path):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': statistics.median(times)}
+
+
+def import_times(top):
+    # the modules imported directly by bubblecreator, by cumulative import time (python -X importtime)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import bubblecreator'], cwd=repo_path,
+                            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    modules = []
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        indent = len(name) - len(name.lstrip())
+        if indent <= 3:
+            modules.append((name.strip(), int(cumulative_us) / 1000))
+    return sorted(modules, key=lambda m: -m[1])[:top]
+
+
+def loaded_heavy_modules():
+    code = 'import sys, bubblecreator; print(" ".join(sorted(set(m.split(".")[0] for m in sys.modules))))'
+    result = subprocess.run([sys.executable, '-c', code], cwd=repo_path, check=True, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    loaded = set(result.stdout.decode().split())
+    return [m for m in heavy_modules if m in loaded]
+
+
+def emoji_table_times(work_path, repeat):
+    # in fresh processes, so that neither the in-process table nor the compiled pattern is reused
+    json_path = os.path.join(work_path, 'emoji-codes.json')
+    shutil.copy(os.path.join(repo_path, 'emoji-codes.json'), json_path)
+    code = ('import re, time, bubblecreator; s = time.perf_counter(); '
+            'd, p, l = bubblecreator.load_emoji_table({!r}); re.compile(p); '
+            'print(time.perf_counter() - s)').format(json_path)
+
+    def measure(remove_cache):
+        times = []
+        for _ in range(repeat):
+            if remove_cache and os.path.isfile(json_path + '.cache'):
+                os.remove(json_path + '.cache')
+            result = subprocess.run([sys.executable, '-c', code], cwd=repo_path, check=True, stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL)
+            times.append(float(result.stdout.decode()))
+        return {'min': min(times), 'median': statistics.median(times)}
+
+    return {'without_cache': measure(True), 'with_cache': measure(False)}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Startup time benchmark for the converter.')
+    arg_parser.add_argument('-r', '--repeat', type=int, default=10, help='Number of runs per measurement')
+    arg_parser.add_argument('--top', type=int, default=10, help='Number of imported modules to list')
+    arg_parser.add_argument('--json', help='Also write the results to this JSON file')
+    args = arg_parser.parse_args()
+
+    work_path = tempfile.mkdtemp(prefix='bc2-startup-')
+    try:
+        results = {
+            'python': time_process([sys.executable, '-c', 'pass'], args.repeat),
+            'import': time_process([sys.executable, '-c', 'import bubblecreator'], args.repeat),
+            'imports': import_times(args.top),
+            'heavy_modules_loaded': loaded_heavy_modules(),
+            'emoji_table': emoji_table_times(work_path, args.repeat)
+        }
+
+        # a complete run on a tiny chat without media
+        export_path = os.path.join(work_path, 'export')
+        no_media = {'voice': 0, 'sticker': 0, 'video': 0, 'photo': 0, 'file': 0, 'link': 0}
+        ExportGenerator(export_path, no_media).generate(20)
+        results['tiny_run'] = time_process([sys.executable, 'bubblecreator.py', export_path,
+                                            os.path.join(work_path, 'output')], args.repeat)
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+
+    print('{:40} {:>10} {:>10}'.format('', 'min ms', 'median ms'))
+    for name, key in [('Python without imports', 'python'), ('import bubblecreator', 'import'),
+                      ('Complete run, 20 text messages', 'tiny_run')]:
+        print('{:40} {:10.1f} {:10.1f}'.format(name, results[key]['min'] * 1000, results[key]['median'] * 1000))
+    for name, key in [('Emoji table without cache', 'without_cache'), ('Emoji table with cache', 'with_cache')]:
+        timing = results['emoji_table'][key]
+        print('{:40} {:10.1f} {:10.1f}'.format(name, timing['min'] * 1000, timing['median'] * 1000))
+    print()
+    print('{:40} {:>10}'.format('Imported by bubblecreator', 'cum. ms'))
+    for name, milliseconds in results['imports']:
+        print('{:40} {:10.1f}'.format(name, milliseconds))
+    print()
+    print('Heavy libraries loaded by the import: ' + (', '.join(results['heavy_modules_loaded']) or 'none'))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Generates a synthetic Telegram chat export (result.json plus small media files) for benchmarking, so that no real
+# private chats are needed. The mix of message types can be tuned on the command line.
+#
+# Usage: python benchmarks/synthetic_export.py target [-n MESSAGES] [--voice RATIO] [--sticker RATIO] ...
+
+import argparse
+import base64
+import datetime
+import json
+import os
+import random
+import struct
+import sys
+import zlib
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# a 1x1 pixel lossless WEBP image
+webp_image = base64.b64decode('UklGRhoAAABXRUJQVlA4TA0AAAAvAAAAEAcQERGIiP4HAA==')
+
+default_mix = {
+    'emoji_density': .05,  # share of words in a text that are emojis
+    'link': .05,
+    'forwarded': .03,
+    'voice': .02,
+    'sticker': .05,
+    'video': .01,
+    'photo': .03,
+    'file': .01
+}
+
+words = ['hello', 'see', 'you', 'tomorrow', 'at', 'the', 'station', 'did', 'you', 'get', 'my', 'message', 'price_tag',
+         '100%', 'Tom & Jerry', '#weekend', '"quoted"', 'x^2', 'ok', 'lol', 'what', 'weather', 'is', 'nice', 'today',
+         'Grüße', 'über', 'schön', 'call', 'me', 'later', 'dinner', 'at', '8']
+
+
+def png_image(width, height, seed):
+    # an uncompressed-looking but valid RGB PNG, built with zlib only
+    def chunk(chunk_type, data):
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+    rnd = random.Random(seed)
+    color = bytes([rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)])
+    raw = b''.join(b'\x00' + color * width for _ in range(height))
+    return b'\x89PNG\r\n\x1a\n' \
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) \
+        + chunk(b'IDAT', zlib.compress(raw)) \
+        + chunk(b'IEND', b'')
+
+
+def ogg_crc(data):
+    # CRC-32 as used by Ogg (polynomial 0x04c11db7, not reflected)
+    crc = 0
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04c11db7 if crc & 0x80000000 else crc << 1) & 0xffffffff
+    return crc
+
+
+def ogg_page(packets, granule, sequence, header_type, serial=1):
+    segments = b''
+    for packet in packets:
+        segments += b'\xff' * (len(packet) // 255) + bytes([len(packet) % 255])
+    page = b'OggS' + struct.pack('<BBqIIIB', 0, header_type, granule, serial, sequence, 0, len(segments)) \
+        + segments + b''.join(packets)
+    return page[:22] + struct.pack('<I', ogg_crc(page)) + page[26:]
+
+
+def ogg_opus_silence(seconds):
+    # An Ogg Opus file with the given duration. Every packet only consists of the TOC byte (CELT, fullband, 20 ms),
+    # which the decoder treats as a lost frame and fills with silence.
+    pre_skip = 312
+    head = b'OpusHead' + struct.pack('<BBHIhB', 1, 1, pre_skip, 48000, 0, 0)
+    tags = b'OpusTags' + struct.pack('<I', 9) + b'synthetic' + struct.pack('<I', 0)
+    pages = [ogg_page([head], 0, 0, 0x02), ogg_page([tags], 0, 1, 0x00)]
+
+    packet_count = max(1, int(seconds * 50))
+    granule = pre_skip
+    sequence = 2
+    for start in range(0, packet_count, 250):
+        packets = [b'\xf8'] * min(250, packet_count - start)
+        granule += 960 * len(packets)
+        last = start + 250 >= packet_count
+        pages.append(ogg_page(packets, granule, sequence, 0x04 if last else 0x00))
+        sequence += 1
+    return b''.join(pages)
+
+
+class ExportGenerator(object):
+    def __init__(self, target_path, mix=None, seed=0, media_variants=20):
+        self.target_path = target_path
+        self.mix = dict(default_mix)
+        self.mix.update(mix or {})
+        self.rnd = random.Random(seed)
+        self.media_variants = media_variants  # number of distinct files per media type, like repeated stickers
+
+        with open(os.path.join(repo_path, 'emoji-codes.json')) as ecf:
+            self.emojis = list(json.load(ecf).keys())
+        self.users = [(1000001, 'Alice'), (1000002, 'Bob'), (1000003, 'Carol')]
+
+    def write_media(self):
+        for folder in ['voice_messages', 'stickers', 'video_files', 'photos', 'files']:
+            os.makedirs(os.path.join(self.target_path, folder), exist_ok=True)
+        for i in range(self.media_variants):
+            with open(os.path.join(self.target_path, 'voice_messages', 'audio_{}.ogg'.format(i)), 'wb') as f:
+                f.write(ogg_opus_silence(1 + i % 10))
+            with open(os.path.join(self.target_path, 'stickers', 'sticker_{}.webp_thumb.jpg'.format(i)), 'wb') as f:
+                f.write(webp_image)
+            with open(os.path.join(self.target_path, 'video_files', 'video_{}.mp4_thumb.png'.format(i)), 'wb') as f:
+                f.write(png_image(32, 18, i))
+            with open(os.path.join(self.target_path, 'photos', 'photo_{}.png'.format(i)), 'wb') as f:
+                f.write(png_image(64, 48, i))
+            with open(os.path.join(self.target_path, 'files', 'document_{}.txt'.format(i)), 'w') as f:
+                f.write('synthetic document\n')
+
+    def text(self):
+        tokens = []
+        for _ in range(self.rnd.randint(1, 25)):
+            if self.rnd.random() < self.mix['emoji_density']:
+                tokens.append(self.rnd.choice(self.emojis))
+            else:
+                tokens.append(self.rnd.choice(words))
+        return ' '.join(tokens)
+
+    def message(self, i, date):
+        user_id, user_name = self.users[self.rnd.randrange(len(self.users))]
+        m = {
+            'id': i,
+            'type': 'message',
+            'date': date.strftime('%Y-%m-%dT%H:%M:%S'),
+            'from': user_name,
+            'from_id': 'user{}'.format(user_id),
+            'text': ''
+        }
+        variant = self.rnd.randrange(self.media_variants)
+
+        # pick a message type according to the mix, plain text is the rest
+        r = self.rnd.random()
+        for kind in ['link', 'voice', 'sticker', 'video', 'photo', 'file']:
+            if r < self.mix[kind]:
+                break
+            r -= self.mix[kind]
+        else:
+            kind = 'text'
+
+        if kind == 'link':
+            m['text'] = [self.text() + ' ', {'type': 'link', 'text': 'https://example.com/some-path/page_{}'.format(i)}]
+        elif kind == 'voice':
+            m.update(file='voice_messages/audio_{}.ogg'.format(variant), media_type='voice_message',
+                     mime_type='audio/ogg', duration_seconds=1 + variant % 10)
+        elif kind == 'sticker':
+            m.update(file='stickers/sticker_{}.webp'.format(variant), media_type='sticker',
+                     thumbnail='stickers/sticker_{}.webp_thumb.jpg'.format(variant), sticker_emoji='😀')
+        elif kind == 'video':
+            m.update(file='video_files/video_{}.mp4'.format(variant), media_type='video_file',
+                     thumbnail='video_files/video_{}.mp4_thumb.png'.format(variant), duration_seconds=5 + variant)
+        elif kind == 'photo':
+            m.update(photo='photos/photo_{}.png'.format(variant), width=64, height=48, text=self.text())
+        elif kind == 'file':
+            m.update(file='files/document_{}.txt'.format(variant), text=self.text())
+        else:
+            m['text'] = self.text()
+
+        if self.rnd.random() < self.mix['forwarded']:
+            m['forwarded_from'] = self.rnd.choice(['Some Channel', 'Dave', 'News'])
+        return m
+
+    def generate(self, message_count):
+        # Writes result.json one message at a time, so even millions of messages don't have to fit into memory.
+        os.makedirs(self.target_path, exist_ok=True)
+        self.write_media()
+
+        date = datetime.datetime(2015, 1, 1, 8, 0, 0)
+        with open(os.path.join(self.target_path, 'result.json'), 'w') as f:
+            f.write('{\n "name": "Synthetic Chat",\n "type": "personal_chat",\n "id": 4242,\n "messages": [')
+            for i in range(message_count):
+                date += datetime.timedelta(seconds=self.rnd.randint(5, 4 * 3600))
+                f.write(',\n  ' if i else '\n  ')
+                f.write(json.dumps(self.message(i + 1, date), ensure_ascii=False))
+            f.write('\n ]\n}\n')
+
+
+def add_mix_arguments(arg_parser):
+    for key, value in default_mix.items():
+        arg_parser.add_argument('--' + key.replace('_', '-'), type=float, default=value,
+                                help='Share of {} (default: {})'.format(key.replace('_', ' '), value))
+
+
+def mix_from_arguments(args):
+    return {key: getattr(args, key) for key in default_mix}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Generates a synthetic Telegram chat export.')
+    arg_parser.add_argument('target', help='Directory for result.json and the media files')
+    arg_parser.add_argument('-n', '--messages', type=int, default=10000, help='Number of messages')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    add_mix_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    ExportGenerator(args.target, mix_from_arguments(args), args.seed).generate(args.messages)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,65 +7,309 @@ import datetime
 import sys
 import argparse
 import logging
+import re
 import shutil
 import tqdm
-from webptools import dwebp
-from media_extraction import ogg_to_pdf, thumbnail_from_video
+import hashlib
+import time
+import cProfile
+import marshal
+import collections
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from media_extraction import voice_graph, voice_graph_path, voice_graph_params, webp_to_png, dwebp_to_png, \
+    keyframe_from_video, thumbnail_from_video, downscale_image
+from mediapipeline import MediaPipeline, MediaRecorder
+from mediacache import MediaCache
+from compilescheduler import CompileScheduler
+from instrumentation import Stats
+from jsonstream import iter_array, iter_members, read_value
+from messageindex import MessageIndex
+from chunklayout import ChunkLayout
+
+# LaTeX symbols that have to be escaped
+latex_bad = {
+    '_': r'\_',
+    '^': r'\^{}',
+    '℃': r'$^{\circ}$C',
+    '"': "``",
+    '#': r'\#',
+    '%': r'\%',
+    '\ufe0f': '',
+    '\u1f3fe': '',
+    '&': r'\&'  # TODO complete
+}
+
+# width of the text area of template.tex (A4 with 2cm margins), the upper bound for the printed width of images
+text_width_inches = 17 / 2.54
+
+
+def build_start_pattern(words):
+    # Builds a character class matching every character a word can start with. Consecutive code points are merged
+    # into ranges, which keeps the class short enough for the regex engine to skip plain text quickly.
+    code_points = sorted(set(ord(word[0]) for word in words))
+    ranges = []
+    for code_point in code_points:
+        if ranges and ranges[-1][1] == code_point - 1:
+            ranges[-1][1] = code_point
+        else:
+            ranges.append([code_point, code_point])
+
+    character_class = ''
+    for first, last in ranges:
+        character_class += re.escape(chr(first))
+        if last != first:
+            character_class += '-' + re.escape(chr(last))
+    return '[' + character_class + ']'
+
+
+def build_clean_tables(emoji_data):
+    # The pattern finding every emoji and LaTeX symbol, and for every first character the lengths of the tokens
+    # starting with it, longest first.
+    tokens = list(emoji_data.keys()) + list(latex_bad.keys())
+    token_lengths = {}
+    for token in tokens:
+        token_lengths.setdefault(token[0], set()).add(len(token))
+    for first_character, lengths in token_lengths.items():
+        token_lengths[first_character] = sorted(lengths, reverse=True)
+    return build_start_pattern(tokens), token_lengths
+
+
+emoji_tables = {}  # path -> (signature, table), for further runs in the same process
+
+
+def load_emoji_table(json_path):
+    # Returns (emoji data, pattern, token lengths) for emoji-codes.json. Building the pattern and the token lengths
+    # takes several times longer than parsing the JSON file, so they are kept in a marshal file next to it, which is
+    # built again when the JSON file (or latex_bad) changes. The whole table is also kept for further runs in the
+    # same process.
+    st = os.stat(json_path)
+    signature = [st.st_size, st.st_mtime_ns, sorted(latex_bad.items())]
+    if json_path in emoji_tables and emoji_tables[json_path][0] == signature:
+        return emoji_tables[json_path][1]
+
+    with open(json_path) as ecf:
+        emoji_data = json.load(ecf)
+
+    tables = None
+    cache_path = json_path + '.cache'
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_signature, cached_tables = marshal.loads(f.read())
+        if cached_signature == signature:
+            tables = cached_tables
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    if tables is None:
+        tables = build_clean_tables(emoji_data)
+        try:
+            with open(cache_path + '.tmp', 'wb') as f:
+                marshal.dump((signature, tables), f)
+            os.replace(cache_path + '.tmp', cache_path)
+        except OSError as e:
+            logging.debug('Could not write the emoji cache {}: {}'.format(cache_path, e))
+
+    table = (emoji_data,) + tuple(tables)
+    emoji_tables[json_path] = (signature, table)
+    return table
+
+
+def plain_user_id(user_id):
+    # Exports write user ids either as numbers or as strings like 'user123456'.
+    user_id = str(user_id)
+    return user_id[4:] if user_id.startswith('user') else user_id
+
+
+def convert_chat(settings, chat, compile=False, incremental=False):
+    # Converts one chat of a full account export in a worker process of BubbleCreator.run_batch.
+    bc = BubbleCreator()
+    bc.media.workers = settings.pop('media_workers')
+    for name, value in settings.items():
+        setattr(bc, name, value)
+    bc.destination_path = os.path.join(bc.assets_path, chat['directory'])
+    bc.messages_start = chat['start']
+    bc.index_file_name = 'bc2-index-' + chat['directory'] + '.bin'
+
+    start_time = time.perf_counter()
+    bc.run_chat(compile=compile, incremental=incremental)
+    return {
+        'messages': sum(n for name, n in bc.stats.counters.items() if name.startswith('messages.')),
+        'files_written': bc.stats.counters.get('files_written', 0),
+        'media_failed': bc.stats.counters.get('media_failed', 0),
+        'pdflatex_failed': bc.stats.counters.get('pdflatex_failed', 0),
+        'seconds': round(time.perf_counter() - start_time, 3)
+    }
+
+
+def convert_chat_alone(settings, chat, compile=False, incremental=False):
+    # Runs convert_chat in a process of its own, so that a crash only fails this chat, see BubbleCreator.run_batch.
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(convert_chat, settings, chat, compile, incremental).result()
+
+
+render_worker = None  # the BubbleCreator of a render worker process, see init_render_worker
+
+
+def init_render_worker(settings):
+    # Sets up a worker process of the render pool of BubbleCreator.convert. The media jobs of the rendered messages
+    # are only recorded here and submitted by the main process.
+    global render_worker
+    render_worker = BubbleCreator()
+    render_worker.media = MediaRecorder()
+    for name, value in settings.items():
+        setattr(render_worker, name, value)
+    render_worker.load_emoji_data()
+
+
+def render_shard(messages):
+    # Renders consecutive messages of one LaTeX file in a render worker. Returns the ChunkLayout, the emoji used, the
+    # recorded media jobs and the statistics of the shard.
+    bc = render_worker
+    bc.stats = Stats()
+    bc.chunk_emoji = {}
+    layout = bc.layout_chunk(messages)
+    return layout, bc.chunk_emoji, bc.media.claim(), bc.stats
 
 
 class BubbleCreator(object):
     def __init__(self):
         self.emoji_data = None
-        self.self_user_id = None
+        self.emoji_available = {}
+        self.clean_pattern = None
+        self.clean_token_lengths = {}
+        self.chunk_emoji = {}  # emoji code -> occurrences in the file that is currently written
+        self.self_user_id = None  # the user on the right side, asked for in prepare if not set
         self.data_path = None
         self.destination_path = None
         self.json_file_path = None
+        self.messages_start = 0  # byte offset of the chat in json_file_path, for the chats of a full account export
+        self.assets_path = None  # folder with the template assets and emoji images, if not the destination folder
+
+        # offsets, dates and senders of all messages, kept next to the export (see MessageIndex)
+        self.index = None
+        self.index_file_name = 'bc2-index.bin'
+        self.use_index_file = True
+
+        # only the messages from first_date to last_date (datetime.date) by the given senders are converted
+        self.first_date = None
+        self.last_date = None
+        self.senders = None
+        self.selected_messages = None  # numbers of the messages in the index, None for all
         self.config_file_path = None
         self.emoji_images_path = None
         self.bg_path = None
 
         self.template_path = 'template'
+        self.emoji_codes_path = './emoji-codes.json'
+        self.manifest_file_name = 'bc2-manifest.json'
+        self.max_message_per_file = 1000
+        self.compile_jobs = None
+        # processes rendering the messages into LaTeX, None for one per CPU; with 1 they are rendered by this process
+        self.render_jobs = 1
+        self.render_shard_size = 250  # messages rendered at once by a render worker
+        self.photo_dpi = 300
+        self.use_format = True
+        self.format_name = 'bc2-preamble'
+
+        self.stats = Stats()
+        self.report_file_name = 'bc2-report.json'
+        self.batch_file_name = 'bc2-chats.json'
+
+        self.media = MediaPipeline(stats=self.stats)
+        self.use_media_cache = True
+        self.media_cache_size = 1 << 30
+        self.preview = False  # draw the chat directly to PDF with reportlab instead of writing LaTeX files
+        self.in_process_decoders = True  # decode stickers and videos with Pillow / PyAV instead of dwebp / ffmpeg
+
+    def prepare_tex_cleaning(self):
+        # Emojis and LaTeX symbols are found with one precompiled pattern, so every string is only scanned once.
+        pattern, self.clean_token_lengths = build_clean_tables(self.emoji_data)
+        self.clean_pattern = re.compile(pattern)
+        self.emoji_available = {}
+
+    def load_emoji_data(self):
+        # like prepare_tex_cleaning, but with the prebuilt table of load_emoji_table
+        self.emoji_data, pattern, self.clean_token_lengths = load_emoji_table(self.emoji_codes_path)
+        self.clean_pattern = re.compile(pattern)
+        self.emoji_available = {}
+
+    def emoji_file_name(self, code):
+        return os.path.join(self.emoji_images_path, code.replace('+', '').replace('U', 'u').replace(' ', ''))
+
+    def emoji_image_exists(self, code):
+        # The lookup is cached per code point, so each emoji image is only checked once per run.
+        if code not in self.emoji_available:
+            file_name = self.emoji_file_name(code)
+            self.emoji_available[code] = os.path.isfile(file_name + '.png') or os.path.isfile(file_name + '.pdf')
+        return self.emoji_available[code]
 
     def clean_string_for_tex(self, input_string):
-        output_string = input_string
-
-        # replace emojis with images
-        for emoji_character in self.emoji_data.keys():
-            # check if string contains current emoji
-            if emoji_character in output_string:
-                # check if we have that emoji as an image file
-                file_name = os.path.join(self.emoji_images_path,
-                                         self.emoji_data[emoji_character].replace('+', '').replace('U', 'u').replace(' ', ''))
-                if os.path.isfile(file_name + '.png') or os.path.isfile(file_name + '.pdf'):
-                    output_string = output_string.replace(emoji_character, self.tex_cmd_emoji(self.emoji_data[emoji_character]))
+        start_time = time.perf_counter()
+        output_parts = []
+        used_codes = []
+        missing_codes = []
+        position = 0
+
+        match = self.clean_pattern.search(input_string)
+        while match:
+            start = match.start()
+            # find the longest emoji or symbol starting at this character
+            for length in self.clean_token_lengths[input_string[start]]:
+                end = start + length
+                token = input_string[start:end]
+                if token in self.emoji_data or token in latex_bad:
+                    break
+            else:
+                match = self.clean_pattern.search(input_string, start + 1)
+                continue
+
+            output_parts.append(input_string[position:start])
+            if token in self.emoji_data:
+                # replace emojis with images, if we have that emoji as an image file
+                code = self.emoji_data[token]
+                if self.emoji_image_exists(code):
+                    output_parts.append(self.tex_cmd_emoji(code))
+                    used_codes.append(code)
                 else:
-                    # command = r'\includegraphics[width=.1\textwidth]{' + 'missing-emoji.pdf' + '}'
-                    # output_string = output_string.replace(emoji_character, command)
-                    output_string = '(emoji picture missing: {})'.format(file_name)
-
-        # replace latex symbols with escaped symbols
-        latex_bad = {
-            '_': r'\_',
-            '^': r'\^{}',
-            '℃': r'$^{\circ}$C',
-            '"': "``",
-            '#': r'\#',
-            '%': r'\%',
-            '\ufe0f': '',
-            '\u1f3fe': '',
-            '&': r'\&'  # TODO complete
-        }
-        for emoji_character in latex_bad.keys():
-            output_string = output_string.replace(emoji_character, latex_bad[emoji_character])
+                    missing_codes.append(code)
+            else:
+                # replace latex symbols with escaped symbols
+                output_parts.append(latex_bad[token])
+
+            position = end
+            match = self.clean_pattern.search(input_string, position)
+
+        output_parts.append(input_string[position:])
+        output_string = ''.join(output_parts)
+
+        # the emojis are only declared and counted if they are part of the output
+        if missing_codes:
+            output_string = self.clean_string_for_tex(
+                '(emoji picture missing: {})'.format(self.emoji_file_name(missing_codes[0])))
+        else:
+            for code in used_codes:
+                self.chunk_emoji[code] = self.chunk_emoji.get(code, 0) + 1
 
         # print('cleaned: ' + input_string + ' --> ' + output_string)
+        self.stats.add_time('emoji_scan', time.perf_counter() - start_time)
         return output_string
 
-    # gives the includegraphics latex command with the right emoji path for an utf emoji code
+    def emoji_name(self, code):
+        return code.replace('+', '').replace('U', 'u')
+
+    # gives the latex command for an utf emoji code. The image itself is declared once per file, see
+    # tex_emoji_declarations.
     def tex_cmd_emoji(self, code):
-        file_name = 'emoji/' + code.replace('+', '').replace('U', 'u')
-        command = r'\includegraphics[width=.1\textwidth]{' + file_name + '}'
-        return command
+        return r'\emoji{' + self.emoji_name(code) + '}'
+
+    # gives the declarations for all emojis used in the current file, with the right emoji paths
+    def tex_emoji_declarations(self):
+        declarations = ''
+        for code in sorted(self.chunk_emoji):
+            name = self.emoji_name(code)
+            declarations += r'\declareemoji{' + name + '}{emoji/' + name + '}' + '\n'
+        return declarations
 
     def format_seconds(self, s):
         seconds = s
@@ -76,6 +320,7 @@ class BubbleCreator(object):
     def format_url(self, unbreakable_link):
         # problem: Links are counted as long words in LaTeX
         # solution: We add the \- command after every character, that allows a line break
+        start_time = time.perf_counter()
         breakable_link = ''
         distance_to_backslash = 0  # if we find a backslash, we only insert \- a bit later again
         for j in range(len(unbreakable_link)):
@@ -98,6 +343,7 @@ class BubbleCreator(object):
                         else:
                             breakable_link += r'\-' + unbreakable_link[j]
 
+        self.stats.add_time('format_url', time.perf_counter() - start_time)
         return breakable_link
 
     def format_voice_message(self, p_message):
@@ -105,12 +351,11 @@ class BubbleCreator(object):
         message_tex_content = r'\includegraphics[width=.15\textwidth]{playbutton.pdf} '
         if 'file' in p_message:
             ogg_path = os.path.join(self.data_path, curr_file)
-            voice_graph_path = os.path.join(self.destination_path, 'voice_graphs')
-            if os.path.isfile(ogg_path):
-                if not os.path.isdir(voice_graph_path):
-                    os.mkdir(voice_graph_path)
-                fn = ogg_to_pdf(ogg_path, voice_graph_path)
-                rfn = 'voice_graphs' + os.path.pathsep + os.path.basename(fn)
+            voice_graph_folder = os.path.join(self.destination_path, 'voice_graphs')
+            if os.path.isfile(ogg_path) and ogg_path.endswith('.ogg'):
+                os.makedirs(voice_graph_folder, exist_ok=True)
+                fn = voice_graph_path(ogg_path, voice_graph_folder)
+                self.media.submit(voice_graph, ogg_path, fn, params=voice_graph_params)
                 message_tex_content += r'\includegraphics[width=.5\textwidth]{' + fn + r'} \\'
         message_tex_content += r'Voice Message'
         if 'duration_seconds' in p_message:
@@ -119,34 +364,58 @@ class BubbleCreator(object):
 
         return message_tex_content
 
-    def prepare(self, message_data):
-        # collect users from chat data
-        global self_user_id
-        users = []
-        user_names = []
-
-        for m in message_data:
-            if 'from_id' in m:
-                if not m['from_id'] in users:
-                    users.append(m['from_id'])
-                    if m['from'] is None:
-                        user_names.append('Unknown User')
-                    else:
-                        user_names.append(m['from'])
-
-            elif 'actor_id' in m:
-                if not m['actor_id'] in users:
-                    users.append(m['actor_id'])
-                    if m['actor'] is None:
-                        user_names.append('Unknown User')
-                    else:
-                        user_names.append(m['actor'])
+    def iter_messages(self):
+        # The messages are read from the JSON file one at a time instead of loading the whole export into memory. If
+        # only some messages are selected, they are read directly at their offsets from the index.
+        if self.selected_messages is not None:
+            return self.stats.timed_iter('read_messages', self.index.iter_messages(self.selected_messages))
+        return self.stats.timed_iter('read_messages', iter_array(self.json_file_path, ('messages',),
+                                                                     start=self.messages_start))
+
+    def print_image(self, source_path, folder, width):
+        # Photos are scaled down to photo_dpi for the width they are printed with (as a fraction of \textwidth) and
+        # compressed again, so pdflatex doesn't have to embed the full resolution files. Returns the path to use in
+        # the LaTeX file.
+        if not self.photo_dpi or not os.path.isfile(source_path):
+            return source_path
+
+        target_folder = os.path.join(self.destination_path, folder)
+        os.makedirs(target_folder, exist_ok=True)
+        name, extension = os.path.splitext(os.path.basename(source_path))
+        target_path = os.path.join(target_folder, name + ('.png' if extension.lower() == '.png' else '.jpg'))
+
+        max_width = int(width * text_width_inches * self.photo_dpi)
+        self.media.submit(downscale_image, source_path, target_path, params={'max_width': max_width, 'quality': 85})
+        return target_path
+
+    def prepare(self):
+        # The users of the chat are taken from the message index, which is only built (by reading the whole chat once)
+        # if the export changed since the last run.
+        index_path = None
+        if self.use_index_file:
+            index_path = os.path.join(self.data_path, self.index_file_name)
+        with self.stats.timer('index'):
+            self.index = MessageIndex.open(self.json_file_path, index_path, self.message_kind, self.messages_start)
+        users = [user_id for user_id, user_name in self.index.users]
+        user_names = [user_name for user_id, user_name in self.index.users]
+
+        self.select_messages()
 
         # select user who is 'you'
         print('The following users have been found in the chat:')
         for i in range(len(users)):
             print('{}: {} ({})'.format(i, user_names[i], users[i]))
 
+        if self.self_user_id is not None:
+            # given in advance, e.g. for a whole account export; the chat may write the id in another form
+            for i in range(len(users)):
+                if plain_user_id(users[i]) == plain_user_id(self.self_user_id):
+                    print('Selected {} ({})'.format(user_names[i], users[i]))
+                    self.self_user_id = users[i]
+                    return
+            logging.warning('User {} has not written in this chat.'.format(self.self_user_id))
+            return
+
         choice = -1
         choice = 0  # fixme: this line is only for testing!
         while not choice in range(len(users)):
@@ -156,12 +425,24 @@ class BubbleCreator(object):
                 print('Please enter a valid number between {} and {}.'.format(0, len(users) - 1))
 
         print('Selected {} ({})'.format(user_names[choice], users[choice]))
-        self_user_id = users[choice]
+        self.self_user_id = users[choice]
+
+    def select_messages(self):
+        # Only the messages of the date range and senders given, if any, are converted.
+        if self.first_date is None and self.last_date is None and self.senders is None:
+            self.selected_messages = None
+            return
+
+        senders = None
+        if self.senders is not None:
+            wanted = set(plain_user_id(s) for s in self.senders)
+            senders = set(user_id for user_id, user_name in self.index.users if plain_user_id(user_id) in wanted)
+        self.selected_messages = self.index.select(self.first_date, self.last_date, senders)
+        self.stats.count('messages_selected', len(self.selected_messages))
+        print('{} of {} messages selected.'.format(len(self.selected_messages), len(self.index)))
 
     def process_message(self, p_message):
-        curr_from_id = p_message.get('from_id', '')
         curr_forwarded_from = p_message.get('forwarded_from', '')
-        curr_date = str(p_message.get('date', 'yyyy-mm-ddThh:mm:ss'))[11:-3]
         curr_text = p_message.get('text', 'Message text could not be retrieved.')
         curr_photo = p_message.get('photo', '')
         curr_file = p_message.get('file', '')
@@ -203,17 +484,18 @@ class BubbleCreator(object):
 
             if 'thumbnail' in p_message:
                 source_thumbnail_path = os.path.join(self.data_path, p_message.get('thumbnail'))
-                message_tex_content += r'\includegraphics[width=.5\textwidth]{' + source_thumbnail_path + r'} '
+                thumbnail_path = self.print_image(source_thumbnail_path, 'thumbnails', .5)
+                message_tex_content += r'\includegraphics[width=.5\textwidth]{' + thumbnail_path + r'} '
             elif 'file' in p_message:
                 # If there is a file but not a thumbnail, we have to create the thumbnail ourselves.
                 target_thumbnail_folder = os.path.join(self.destination_path, 'thumbnails')
-                if not os.path.exists(target_thumbnail_folder):
-                    os.mkdir(target_thumbnail_folder)
+                os.makedirs(target_thumbnail_folder, exist_ok=True)
 
                 source_file_path = os.path.join(self.data_path, curr_file)
                 target_thumbnail_path = os.path.join(target_thumbnail_folder,
                                                      os.path.basename(source_file_path) + '.jpg')
-                thumbnail_from_video(source_file_path, target_thumbnail_path)
+                self.media.submit(keyframe_from_video if self.in_process_decoders else thumbnail_from_video,
+                                  source_file_path, target_thumbnail_path)
 
                 message_tex_content += r'\includegraphics[width=.5\textwidth]{' + target_thumbnail_path + r'} '
 
@@ -228,20 +510,17 @@ class BubbleCreator(object):
             target_thumbnail_path = os.path.join(target_thumbnail_folder,
                                                  os.path.basename(source_thumbnail_path)[:-3] + 'png')
 
-            if not os.path.isdir(target_thumbnail_folder):
-                os.mkdir(target_thumbnail_folder)
+            os.makedirs(target_thumbnail_folder, exist_ok=True)
 
-            logging.debug(dwebp(input_image='"' + source_thumbnail_path + '"',
-                                output_image='"' + target_thumbnail_path + '"',
-                                option="-o",
-                                logging="-v"))
+            self.media.submit(webp_to_png if self.in_process_decoders else dwebp_to_png,
+                              source_thumbnail_path, target_thumbnail_path)
 
             message_tex_content += r'\includegraphics[width=.4\textwidth]{' + target_thumbnail_path + r'} '
 
         else:
             # process photo
             if curr_photo != '':
-                photo_path = os.path.join(self.data_path, curr_photo)
+                photo_path = self.print_image(os.path.join(self.data_path, curr_photo), 'photos', .75)
                 message_tex_content += r'\includegraphics[width=.75\textwidth]{' + photo_path + '}\\\\ '
             # process file
             elif curr_file != '':
@@ -254,74 +533,30 @@ class BubbleCreator(object):
 
         return message_tex_content
 
-    def convert(self, message_data, compile_after_convert=False):
-        max_message_per_file = 1000
-
-        structured_messages = []  # Messages grouped by sender.
-
-        # Go through all messages in the list:
-        # for curr_message in message_data:
-        for j in tqdm.tqdm(range(len(message_data)), desc='Step 1 (Converting)', file=sys.stdout):
-            curr_message = message_data[j]
-            # Each curr_message is a dict object.
-            curr_from_id = curr_message.get('from_id', '')
-            curr_date = str(curr_message.get('date', 'yyyy-mm-ddThh:mm:ss'))[11:-3]
-
-            message_tex_content = self.process_message(curr_message)
-
-            if curr_from_id == self_user_id:
-                date_command = '\\rmsgtime{' + str(curr_date) + '}'
-            else:
-                date_command = '\\lmsgtime{' + str(curr_date) + '}'
-
-            # The following code segment groups message contents together by sender. This makes it look prettier in the
-            # final file, since like this, the edges of the grouped messages 'point' towards the sender.
-            if not structured_messages:
-                first_entry = {
-                    'sender': curr_from_id,
-                    'message': message_tex_content + date_command,
-                    'date': datetime.datetime.strptime(str(curr_message['date']), '%Y-%m-%dT%H:%M:%S')
-                }
-                structured_messages.append(first_entry)
-            else:
-                l = len(structured_messages) - 1
-                if structured_messages[l]['sender'] == curr_from_id:
-                    structured_messages[l]['message'] += u'\n\n' + message_tex_content + date_command
-                else:
-                    new_entry = {
-                        'sender': curr_from_id,
-                        'message': message_tex_content + date_command,
-                        'date': datetime.datetime.strptime(str(curr_message['date']), '%Y-%m-%dT%H:%M:%S')
-                    }
-                    structured_messages.append(new_entry)
-
-        final_strings = []
-        for j in range(int(len(structured_messages) / max_message_per_file) + 1):  # add 1 to be sure
-            final_strings.append(u'')
-
-        curr_part = 0
-        last_date = datetime.datetime(1900, 1, 1, 0, 0, 0)
-
-        # for curr_message in structured_messages:
-        for j in tqdm.tqdm(range(len(structured_messages)), desc='Step 2 (Making bubbles)', file=sys.stdout):
-            curr_message = structured_messages[j]
-            d = curr_message['date']
-            if last_date.date() != d.date():
-                final_strings[curr_part] += '\\datebubble{' + '{}.{}.{}'.format(d.day, d.month, d.year) + '}\n'
-                last_date = curr_message['date']
-
-            if curr_message['sender'] == self_user_id:
-                final_strings[curr_part] += u'\\begin{rightbubbles}\n' \
-                                            + curr_message['message'] \
-                                            + u'\n\\end{rightbubbles}\n'
-            else:
-                final_strings[curr_part] += u'\\begin{leftbubbles}\n' \
-                                            + curr_message['message'] \
-                                            + u'\n\\end{leftbubbles}\n'
+    def message_kind(self, p_message):
+        # the type of a message as used in the statistics
+        if p_message.get('media_type'):
+            return p_message['media_type']
+        if 'photo' in p_message:
+            return 'photo'
+        if 'file' in p_message:
+            return 'file'
+        if isinstance(p_message.get('text'), list):
+            return 'text_with_entities'
+        return 'text'
 
-        with open('template/template.tex', 'r') as f:
+    def load_template(self):
+        with open(os.path.join(self.template_path, 'template.tex'), 'r') as f:
             template = f.read()
 
+        # images that are not in the destination folder are searched in the shared assets folder
+        graphics_path_placeholder = '%GRAPHICS_PATH_PLACEHOLDER'
+        if self.assets_path is None:
+            template = template.replace(graphics_path_placeholder + '\n', '')
+        else:
+            relative_path = os.path.relpath(self.assets_path, self.destination_path).replace(os.sep, '/')
+            template = template.replace(graphics_path_placeholder, r'\graphicspath{{' + relative_path + '/}}')
+
         bg_decl_placeholder = '%BACKGROUND_DECLARATION_PLACEHOLDER'
         if self.bg_path is None:
             logging.debug('No background image set.')
@@ -330,39 +565,416 @@ class BubbleCreator(object):
             bg_declaration = r'\AddToShipoutPictureBG{\includegraphics[height=\paperheight]{' + self.bg_path + r'}}'
             template = template.replace(bg_decl_placeholder, bg_declaration)
 
-        chat_data_placeholder = '%CHAT_DATA_PLACEHOLDER'
-        template_parts = template.split(chat_data_placeholder)
+        return template
+
+    def chunk_file_name(self, j):
+        # The number is not padded to the total amount of files, so the names stay the same when the chat grows.
+        return 'test-out-' + str(j).zfill(3) + '.tex'
+
+    def emoji_folder_signature(self):
+        # Whether an emoji is shown as an image or as '(emoji picture missing: ...)' depends on the files in the emoji
+        # folder, so their names are part of the digest of every chunk.
+        names = []
+        if self.emoji_images_path is not None and os.path.isdir(self.emoji_images_path):
+            names = sorted(os.listdir(self.emoji_images_path))
+        return hashlib.sha256('\n'.join(names).encode('utf-8')).hexdigest()
+
+    def chunk_digest(self, messages, template, emoji_signature=None):
+        # Everything a chunk's LaTeX file depends on: the messages, the template, the available emoji images and the
+        # settings.
+        h = hashlib.sha256()
+        h.update(template.encode('utf-8'))
+        h.update(json.dumps([self.self_user_id, self.photo_dpi, emoji_signature]).encode('utf-8'))
+        for m in messages:
+            h.update(json.dumps(m, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        return h.hexdigest()
+
+    def chunk_unchanged(self, old_chunk, chunk):
+        # Whether the file of old_chunk (from the manifest) can be kept for chunk: the same messages and digest, and
+        # all media files it refers to are still there.
+        if 'media' not in old_chunk or {k: v for k, v in old_chunk.items() if k != 'media'} != chunk:
+            return False
+        return all(os.path.isfile(os.path.join(self.destination_path, path)) for path in old_chunk['media'])
+
+    def load_manifest(self):
+        manifest_path = os.path.join(self.destination_path, self.manifest_file_name)
+        if not os.path.isfile(manifest_path):
+            return {'chunks': []}
+        try:
+            with open(manifest_path, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            logging.warning('Manifest {} is damaged, all files will be written again.'.format(manifest_path))
+            return {'chunks': []}
+
+    def save_manifest(self, manifest):
+        manifest_path = os.path.join(self.destination_path, self.manifest_file_name)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+    def write_bubbles(self, out, sender, layout, first, end):
+        side = 'rightbubbles' if sender == self.self_user_id else 'leftbubbles'
+        out.write(u'\\begin{' + side + '}\n')
+        for n in range(first, end):
+            if n > first:
+                out.write(u'\n\n')
+            out.write(layout.fragment(n))
+        out.write(u'\n\\end{' + side + '}\n')
+
+    def layout_chunk(self, messages):
+        # Renders the given messages into a ChunkLayout. The date of every message is only parsed once here.
+        layout = ChunkLayout()
+        for curr_message in messages:
+            # Each curr_message is a dict object.
+            curr_from_id = curr_message.get('from_id', '')
+            curr_date = curr_message.get('date', 'yyyy-mm-ddThh:mm:ss')
+
+            kind = self.message_kind(curr_message)
+            start_time = time.perf_counter()
+            message_tex_content = self.process_message(curr_message)
+            self.stats.add_time('process_message.' + kind, time.perf_counter() - start_time)
+            self.stats.count('messages.' + kind)
+
+            if curr_from_id == self.self_user_id:
+                date_command = '\\rmsgtime{' + str(curr_date)[11:-3] + '}'
+            else:
+                date_command = '\\lmsgtime{' + str(curr_date)[11:-3] + '}'
+
+            layout.add(curr_from_id, curr_message.get('date'), message_tex_content + date_command)
+        return layout
+
+    def write_layout(self, layout, out):
+        # Writes the bubbles of a ChunkLayout to out. The messages are grouped by sender. This makes it look prettier
+        # in the final file, since like this, the edges of the grouped messages 'point' towards the sender. A date
+        # bubble is put before every group that starts on another day than the last date bubble. The fragments are
+        # written one by one, so neither a group nor the whole file is ever built up in one string.
+        last_day = datetime.date(1900, 1, 1).toordinal()
+        for sender, first, end in layout.groups():
+            day = layout.days[first]
+            if not day:
+                day = layout.date(first).toordinal()
+            if day != last_day:
+                d = datetime.date.fromordinal(day)
+                out.write('\\datebubble{' + '{}.{}.{}'.format(d.day, d.month, d.year) + '}\n')
+                last_day = day
+            self.write_bubbles(out, sender, layout, first, end)
+
+    def render_chunk(self, messages, out):
+        # Writes the bubbles for the given messages to out.
+        self.write_layout(self.layout_chunk(messages), out)
+
+    def render_settings(self):
+        # what a render worker needs to render messages like this BubbleCreator, see init_render_worker
+        names = ['self_user_id', 'data_path', 'destination_path', 'emoji_images_path', 'emoji_codes_path', 'photo_dpi',
+                 'in_process_decoders']
+        return {name: getattr(self, name) for name in names}
+
+    def start_render_pool(self):
+        # Returns a process pool for rendering the messages, or None if they are rendered by this process. Chats that
+        # fit into one shard are always rendered here, starting the pool would take longer.
+        workers = self.render_jobs or os.cpu_count()
+        if self.selected_messages is not None:
+            message_count = len(self.selected_messages)
+        else:
+            message_count = len(self.index) if self.index is not None else None
+        if workers <= 1 or (message_count is not None and message_count <= self.render_shard_size):
+            return None
+        logging.debug('Rendering messages in {} processes'.format(workers))
+        return concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_render_worker,
+                                                      initargs=(self.render_settings(),))
+
+    def preview_runs(self, input_string):
+        # Splits a text into runs of text and emojis (emoji code as a one element tuple) for the preview. Only the
+        # symbols that are left out in LaTeX are removed, the others need no escaping here.
+        runs = []
+        position = 0
+        match = self.clean_pattern.search(input_string)
+        while match:
+            start = match.start()
+            for length in self.clean_token_lengths[input_string[start]]:
+                end = start + length
+                token = input_string[start:end]
+                if token in self.emoji_data or (token in latex_bad and not latex_bad[token]):
+                    break
+            else:
+                match = self.clean_pattern.search(input_string, start + 1)
+                continue
+
+            runs.append(input_string[position:start])
+            if token in self.emoji_data:
+                runs.append((self.emoji_data[token],))
+            position = end
+            match = self.clean_pattern.search(input_string, position)
+        runs.append(input_string[position:])
+        return [run for run in runs if run]
+
+    def preview_emoji_path(self, code):
+        # reportlab can only draw the PNG emoji images
+        path = self.emoji_file_name(code) + '.png'
+        return path if self.emoji_image_exists(code) and os.path.isfile(path) else None
+
+    def preview_message(self, renderer, p_message):
+        curr_from_id = p_message.get('from_id', '')
+        curr_date = str(p_message.get('date', 'yyyy-mm-ddThh:mm:ss'))
+        curr_text = p_message.get('text', 'Message text could not be retrieved.')
+        curr_media_type = p_message.get('media_type', '')
 
+        try:
+            d = datetime.datetime.fromisoformat(curr_date)
+            day = '{}.{}.{}'.format(d.day, d.month, d.year)
+        except ValueError:
+            day = curr_date[:10]
+
+        extra = None
+        if p_message.get('forwarded_from'):
+            extra = 'Forwarded from ' + p_message['forwarded_from']
+
+        # links and other entities are shown as their text
+        if isinstance(curr_text, list):
+            curr_text = ''.join(element.get('text', '') if isinstance(element, dict) else str(element)
+                                for element in curr_text)
+        elif isinstance(curr_text, dict):
+            curr_text = ''
+        else:
+            curr_text = str(curr_text)
+
+        # the same sizes relative to each other as in the LaTeX files
+        images = []
+        if 'thumbnail' in p_message and curr_media_type in ('animation', 'video_file'):
+            images.append((os.path.join(self.data_path, p_message['thumbnail']), .5 / .75))
+        elif 'thumbnail' in p_message and curr_media_type == 'sticker':
+            images.append((os.path.join(self.data_path, p_message['thumbnail']), .4 / .75))
+        elif 'photo' in p_message:
+            images.append((os.path.join(self.data_path, p_message['photo']), 1))
+
+        duration = ''
+        if 'duration_seconds' in p_message:
+            duration = ' (' + self.format_seconds(int(p_message['duration_seconds'])) + ')'
+        if curr_media_type == 'voice_message':
+            curr_text = 'Voice Message' + duration
+        elif curr_media_type in ('animation', 'video_file'):
+            curr_text = 'Video' + duration
+        elif curr_media_type != 'sticker' and 'photo' not in p_message and p_message.get('file'):
+            file_name = os.path.basename(p_message['file'])
+            curr_text = file_name + ('\n' + curr_text if curr_text else '')
+
+        renderer.add_message(curr_from_id, curr_from_id == self.self_user_id, day, curr_date[11:-3], extra,
+                             self.preview_runs(curr_text), images)
+
+    def render_preview(self, message_data):
+        # Draws the messages straight into PDF files (preview-000.pdf, ...) with reportlab instead of writing LaTeX
+        # files. Like the LaTeX files, every file has max_message_per_file messages, so the files are done one after
+        # another and only one of them is kept in memory.
+        from pdfpreview import PreviewRenderer  # only imported when needed, reportlab takes a while to load
+
+        renderer = None
+        j = 0
+        count = 0
+        for curr_message in tqdm.tqdm(message_data, desc='Step 1 (Preview)', file=sys.stdout):
+            if renderer is None:
+                renderer = PreviewRenderer(os.path.join(self.destination_path, self.preview_file_name(j)),
+                                           self.preview_emoji_path)
+            kind = self.message_kind(curr_message)
+            start_time = time.perf_counter()
+            self.preview_message(renderer, curr_message)
+            self.stats.add_time('preview_message.' + kind, time.perf_counter() - start_time)
+            self.stats.count('messages.' + kind)
+
+            count += 1
+            if count == self.max_message_per_file:
+                with self.stats.timer('preview_write'):
+                    self.stats.count('preview_pages', renderer.finish())
+                renderer = None
+                count = 0
+                j += 1
+        if renderer is not None:
+            with self.stats.timer('preview_write'):
+                self.stats.count('preview_pages', renderer.finish())
+            j += 1
+        print('Preview written to {} file(s) in {}'.format(j, self.destination_path))
+
+    def preview_file_name(self, j):
+        return 'preview-' + str(j).zfill(3) + '.pdf'
+
+    def convert(self, message_data, compile_after_convert=False, incremental=False):
+        # The messages are split into files of max_message_per_file messages each, counted from the start of the chat.
+        # Appending messages to the chat therefore only changes the last file(s). A manifest records the message range,
+        # a digest and the media files for every file, so that unchanged files are neither written nor compiled again
+        # when running incrementally. A file whose media are missing (failed or deleted) is written again, which
+        # submits its media conversions again.
+        template = self.load_template()
+
+        # Files are compiled in the background while the next ones are written, as soon as their media are ready.
+        scheduler = None
         if compile_after_convert:
-            os.chdir(self.destination_path)
+            scheduler = CompileScheduler(self.destination_path, max_jobs=self.compile_jobs)
 
-        max_digits = len(str(len(final_strings)))
-        for j in tqdm.tqdm(range(len(final_strings)), desc='Step 3 (Saving LaTeX)', file=sys.stdout):
-            curr_file_name = 'test-out-' + str(j).zfill(max_digits) + '.tex'
-            dest = os.path.join(self.destination_path, curr_file_name)
+            # With a precompiled format of the preamble, the files only contain the document body.
+            if self.use_format:
+                document_start = template.index('\\begin{document}')
+                preamble_document = template[:document_start] + '\\begin{document}\n\\end{document}\n'
+                with self.stats.timer('build_format'):
+                    format_ready = scheduler.prepare_format(self.format_name, preamble_document)
+                if format_ready:
+                    template = '%&' + self.format_name + '\n' + template[document_start:]
 
-            logging.debug('Writing {}th file to {}'.format(j, dest))
-            with open(dest, 'w') as f:
-                f.write(template_parts[0] + final_strings[j] + template_parts[1])
+        chat_data_placeholder = '%CHAT_DATA_PLACEHOLDER'
+        emoji_decl_placeholder = '%EMOJI_DECLARATION_PLACEHOLDER'
+        template_parts = template.split(chat_data_placeholder)
 
-            # Compiling the LaTeX file via system command:
-            if compile_after_convert:
-                os.system('pdflatex ' + dest)
+        old_manifest = self.load_manifest()
+        old_chunks = old_manifest.get('chunks', [])
+        new_chunks = []
+        emoji_signature = self.emoji_folder_signature()
+
+        # With a render pool, every file is split into shards of consecutive messages that are rendered in parallel.
+        # The files are still written one after another, in order: the shards of a file are joined into one
+        # ChunkLayout and written like the layout of the whole file, the media jobs recorded by the workers are only
+        # submitted then.
+        render_pool = self.start_render_pool()
+        max_pending_shards = 2 * (self.render_jobs or os.cpu_count())
+        pending = collections.deque()  # [chunk, unchanged, (layout, emoji) or the futures of the shards]
+
+        def finish_chunk(messages):
+            j = len(new_chunks)
+            curr_file_name = self.chunk_file_name(j)
+            dest = os.path.join(self.destination_path, curr_file_name)
+            chunk = {
+                'file': curr_file_name,
+                'first_id': messages[0].get('id') if messages else None,
+                'last_id': messages[-1].get('id') if messages else None,
+                'messages': len(messages),
+            }
+            with self.stats.timer('digest'):
+                chunk['digest'] = self.chunk_digest(messages, template, emoji_signature)
+            new_chunks.append(chunk)
+
+            unchanged = incremental and j < len(old_chunks) and os.path.isfile(dest) and self.chunk_unchanged(
+                old_chunks[j], chunk)
+            if unchanged:
+                chunk['media'] = old_chunks[j]['media']
+                rendered = None
+            elif render_pool is None:
+                with self.stats.timer('render'):
+                    self.chunk_emoji = {}
+                    rendered = (self.layout_chunk(messages), self.chunk_emoji)
+            else:
+                size = self.render_shard_size
+                rendered = [render_pool.submit(render_shard, messages[first:first + size])
+                            for first in range(0, len(messages), size)]
+            pending.append((chunk, unchanged, rendered))
+
+            while pending and (render_pool is None or
+                               sum(len(p[2]) for p in pending if isinstance(p[2], list)) > max_pending_shards):
+                write_chunk(*pending.popleft())
+
+        def join_shards(shards):
+            with self.stats.timer('render_wait'):
+                results = [shard.result() for shard in shards]
+            emoji = {}
+            for layout, shard_emoji, media_jobs, stats in results:
+                for code, occurrences in shard_emoji.items():
+                    emoji[code] = emoji.get(code, 0) + occurrences
+                for media_job in media_jobs:
+                    self.media.submit(*media_job)
+                self.stats.merge(stats)
+            return ChunkLayout.join([r[0] for r in results]), emoji
+
+        def write_chunk(chunk, unchanged, rendered):
+            dest = os.path.join(self.destination_path, chunk['file'])
+            if unchanged:
+                logging.debug('Skipping unchanged file {}'.format(dest))
+                self.stats.count('files_skipped')
+            else:
+                layout, self.chunk_emoji = join_shards(rendered) if isinstance(rendered, list) else rendered
+                logging.debug('Writing file {}'.format(dest))
+                with self.stats.timer('write'), open(dest, 'w') as f:
+                    # all emojis of the file are known before its body is written, so they can be declared first
+                    f.write(template_parts[0].replace(emoji_decl_placeholder, self.tex_emoji_declarations()))
+                    self.write_layout(layout, f)
+                    f.write(template_parts[1])
+                    self.stats.count('bytes_written', f.tell())
+
+                for code, occurrences in self.chunk_emoji.items():
+                    self.stats.count_in('emoji_usage', code, occurrences)
+                self.stats.count('emoji_declared', len(self.chunk_emoji))
+                self.stats.count('emoji_occurrences', sum(self.chunk_emoji.values()))
+                self.stats.count('files_written')
+
+            media_jobs = self.media.claim()
+            if not unchanged:
+                chunk['media'] = sorted(os.path.relpath(target, self.destination_path) for target in media_jobs)
+            pdf_path = dest[:-4] + '.pdf'
+            if scheduler is not None and (not unchanged or not os.path.isfile(pdf_path)
+                                          or os.path.getmtime(pdf_path) < os.path.getmtime(dest)):
+                scheduler.submit(chunk['file'], wait_for=media_jobs.values())
 
-    def run(self, compile=False):
+        # Go through all messages in the list:
+        try:
+            chunk_messages = []
+            for curr_message in tqdm.tqdm(message_data, desc='Step 1 (Converting)', file=sys.stdout):
+                chunk_messages.append(curr_message)
+                if len(chunk_messages) == self.max_message_per_file:
+                    finish_chunk(chunk_messages)
+                    chunk_messages = []
+            if chunk_messages or not new_chunks:
+                finish_chunk(chunk_messages)
+            while pending:
+                write_chunk(*pending.popleft())
+        finally:
+            if render_pool is not None:
+                render_pool.shutdown(cancel_futures=True)
+
+        # Files of an earlier, longer version of the chat are removed.
+        for chunk in old_chunks[len(new_chunks):]:
+            stale_path = os.path.join(self.destination_path, chunk['file'])
+            if os.path.isfile(stale_path):
+                logging.debug('Removing stale file {}'.format(stale_path))
+                os.remove(stale_path)
+
+        self.save_manifest({'chunks': new_chunks})
+
+        with self.stats.timer('media_wait'):
+            failed_media = self.media.finish()
+        self.stats.count('media_failed', len(failed_media))
+        if scheduler is not None:
+            with self.stats.timer('compile_wait'):
+                results = scheduler.finish()
+            for r in results:
+                self.stats.add_time('pdflatex', r['seconds'])
+                self.stats.count('pdflatex_passes', r['passes'])
+                if r['return_code'] != 0:
+                    self.stats.count('pdflatex_failed')
+
+    def run(self, compile=False, incremental=False):
         # derive various paths from the source / destination paths
         self.json_file_path = os.path.join(self.data_path, 'result.json')
         self.config_file_path = os.path.join(self.data_path, 'bc2-config.json')
-        self.emoji_images_path = os.path.join(self.destination_path, 'emoji')
 
         # check if source path contains the JSON file, if not exit
         if not os.path.isfile(self.json_file_path):
             logging.error('result.json not found in ' + self.data_path)
             sys.exit(1)
 
+        self.run_chat(compile=compile, incremental=incremental)
+
+    def copy_assets(self, target_path):
+        # copy required template files into the given path:
+        assets = ['missing-emoji.pdf', 'playbutton.pdf', 'file.pdf']
+        for a in assets:
+            asset_src_path = os.path.join(self.template_path, a)
+            asset_dst_path = os.path.join(target_path, a)
+            if not os.path.isfile(asset_dst_path):
+                shutil.copy(asset_src_path, asset_dst_path)
+
+    def run_chat(self, compile=False, incremental=False):
+        # Converts the chat starting at byte messages_start of json_file_path into destination_path.
+        assets_path = self.assets_path or self.destination_path
+        self.emoji_images_path = os.path.join(assets_path, 'emoji')
+
         # get emoji data from auxiliary file
-        with open('./emoji-codes.json') as ecf:
-            self.emoji_data = json.load(ecf)
+        self.load_emoji_data()
 
         # create destination path if it doesn't exist
         if not os.path.isdir(self.destination_path):
@@ -373,25 +985,136 @@ class BubbleCreator(object):
         if not os.path.isdir(self.emoji_images_path):
             logging.warning('Emoji image folder does not exist. Will revert to placeholder.')
 
-        # copy required template files into destination path:
-        assets = ['missing-emoji.pdf', 'playbutton.pdf', 'file.pdf']
-        for a in assets:
-            asset_src_path = os.path.join(self.template_path, a)
-            asset_dst_path = os.path.join(self.destination_path, a)
-            if not os.path.isfile(asset_dst_path):
-                shutil.copy(asset_src_path, asset_dst_path)
+        if self.use_media_cache:
+            self.media.cache = MediaCache(os.path.join(self.destination_path, '.bc2-cache'), self.media_cache_size)
 
-        # open the JSON file, read the data
-        with open(self.json_file_path, 'r') as f:
-            string_data = f.read()
-        data = json.loads(string_data)
-        message_data = data.get('messages', '')
+        self.copy_assets(assets_path)
 
         # step 1: preparation
-        self.prepare(message_data)
+        with self.stats.timer('prepare'):
+            self.prepare()
 
         # step 2: generation
-        self.convert(message_data, compile_after_convert=compile)
+        if self.preview:
+            with self.stats.timer('preview'):
+                self.render_preview(self.iter_messages())
+        else:
+            with self.stats.timer('convert'):
+                self.convert(self.iter_messages(), compile_after_convert=compile, incremental=incremental)
+
+        if self.media.cache is not None:
+            print(self.media.cache.summary())
+            self.stats.count('media_cache_hits', self.media.cache.hits)
+            self.stats.count('media_cache_misses', self.media.cache.misses)
+
+        report_path = os.path.join(self.destination_path, self.report_file_name)
+        self.stats.write(report_path)
+        print('Statistics written to ' + report_path)
+
+    def iter_chats(self):
+        # The chats of a full account export, with the byte offset each chat starts at and its size in bytes. Only
+        # the id, name and type of every chat are decoded, the messages are skipped.
+        for chat, begin, end in iter_members(self.json_file_path, ('chats', 'list'), ('id', 'name', 'type')):
+            yield {
+                'id': chat.get('id'),
+                'name': chat.get('name'),
+                'type': chat.get('type'),
+                'directory': 'chat-' + str(chat.get('id')),
+                'start': begin,
+                'size': end - begin
+            }
+
+    def run_batch(self, compile=False, incremental=False, workers=None):
+        # Converts every chat of a full account export (result.json with chats.list) without asking anything. Each
+        # chat gets its own folder in destination_path, the assets and emoji images are shared by all of them. The
+        # chats are converted on a process pool; a chat that fails is reported and the others are converted anyway.
+        # If a worker process dies (e.g. a crash in a media library or the OOM killer), the pool breaks and all chats
+        # that were not done yet are converted again, each in a process of its own.
+        self.json_file_path = os.path.join(self.data_path, 'result.json')
+        if not os.path.isfile(self.json_file_path):
+            logging.error('result.json not found in ' + self.data_path)
+            sys.exit(1)
+
+        if self.self_user_id is None:
+            self.self_user_id = read_value(self.json_file_path, ('personal_information', 'user_id'))
+            if self.self_user_id is None:
+                logging.error('The export contains no personal information, please give the user id with --self-id.')
+                sys.exit(1)
+        print('Using user {} for the right side.'.format(self.self_user_id))
+
+        if not os.path.isdir(self.destination_path):
+            logging.debug('Destination folder was created: ' + self.destination_path)
+            os.mkdir(self.destination_path)
+        self.copy_assets(self.destination_path)
+
+        # the largest chats (in bytes of the export) are started first, so that they don't hold up the end of the batch
+        chats = sorted(self.iter_chats(), key=lambda c: -c['size'])
+        workers = workers or os.cpu_count()
+        settings = {
+            'self_user_id': self.self_user_id,
+            'data_path': self.data_path,
+            'json_file_path': self.json_file_path,
+            'config_file_path': os.path.join(self.data_path, 'bc2-config.json'),
+            'assets_path': self.destination_path,
+            'bg_path': self.bg_path,
+            'template_path': os.path.abspath(self.template_path),
+            'max_message_per_file': self.max_message_per_file,
+            'photo_dpi': self.photo_dpi,
+            'use_format': self.use_format,
+            'use_media_cache': self.use_media_cache,
+            'use_index_file': self.use_index_file,
+            'in_process_decoders': self.in_process_decoders,
+            'preview': self.preview,
+            'render_jobs': self.render_jobs,
+            'first_date': self.first_date,
+            'last_date': self.last_date,
+            'senders': self.senders,
+            'media_cache_size': self.media_cache_size,
+            # the chats already run in parallel
+            'compile_jobs': self.compile_jobs or max(1, os.cpu_count() // workers),
+            'media_workers': self.media.workers or max(1, os.cpu_count() // workers)
+        }
+
+        results = []
+        broken = []  # the chats that were lost with a broken pool
+
+        def collect(futures, retry_broken):
+            for future in concurrent.futures.as_completed(futures):
+                chat = futures[future]
+                result = {'id': chat['id'], 'name': chat['name'], 'type': chat['type'],
+                          'directory': chat['directory']}
+                try:
+                    result.update(future.result())
+                    result['status'] = 'ok'
+                except Exception as e:
+                    if retry_broken and isinstance(e, BrokenProcessPool):
+                        broken.append(chat)
+                        continue
+                    logging.error('Chat {} ({}) failed: {!r}'.format(chat['name'], chat['id'], e))
+                    result['status'] = 'failed'
+                    result['error'] = repr(e)
+                results.append(result)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            collect({executor.submit(convert_chat, dict(settings), chat, compile, incremental): chat
+                     for chat in chats}, True)
+
+        if broken:
+            logging.warning('A worker process died, converting {} chats again one per process.'.format(len(broken)))
+            broken.sort(key=lambda c: -c['size'])
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                collect({executor.submit(convert_chat_alone, dict(settings), chat, compile, incremental): chat
+                         for chat in broken}, False)
+
+        results.sort(key=lambda r: r['directory'])
+        batch_path = os.path.join(self.destination_path, self.batch_file_name)
+        with open(batch_path, 'w') as f:
+            json.dump({'self_user_id': self.self_user_id, 'chats': results}, f, indent=1, ensure_ascii=False)
+
+        failed = [r for r in results if r['status'] != 'ok']
+        print('Converted {} of {} chats, summary written to {}'.format(len(results) - len(failed), len(results),
+                                                                      batch_path))
+        return results
 
 
 if __name__ == '__main__':
@@ -403,13 +1126,74 @@ if __name__ == '__main__':
     arg_parser.add_argument("source", help="Path of the directory containing the exported chat data")
     arg_parser.add_argument("target", help="Target directory for the LaTeX files (will be created if not existing)")
     arg_parser.add_argument("-a", '--autocompile', action='store_true', help="Compile automatically after generation")
+    arg_parser.add_argument("-j", '--jobs', type=int, default=None,
+                            help="Number of worker processes for media conversion (default: number of CPUs)")
+    arg_parser.add_argument('--compile-jobs', type=int, default=None,
+                            help="Number of pdflatex processes running at once (default: number of CPUs)")
+    arg_parser.add_argument('--no-format', action='store_true',
+                            help="Don't precompile the preamble of the template into a format file when compiling")
+    arg_parser.add_argument("-i", '--incremental', action='store_true',
+                            help="Only write and compile the files whose messages changed since the last run")
+    arg_parser.add_argument('--messages-per-file', type=int, default=1000,
+                            help="Number of messages per LaTeX file (default: 1000)")
+    arg_parser.add_argument('--profile', action='store_true',
+                            help="Run with cProfile and write the statistics to bc2-profile.pstats in the target directory")
+    arg_parser.add_argument('--photo-dpi', type=int, default=300,
+                            help="Resolution photos are scaled down to for printing, 0 keeps the originals (default: 300)")
+    arg_parser.add_argument('--cache-size', type=int, default=1024,
+                            help="Size limit of the media cache in the target directory in MB (default: 1024)")
+    arg_parser.add_argument('--no-cache', action='store_true', help="Don't reuse converted media from earlier runs")
+    arg_parser.add_argument('--self-id', default=None,
+                            help="Id of the user on the right side (default: ask, or from the account data with --batch)")
+    arg_parser.add_argument('--batch', action='store_true',
+                            help="Convert every chat of a full account export into its own folder in the target directory")
+    arg_parser.add_argument('--batch-jobs', type=int, default=None,
+                            help="Number of chats converted at once with --batch (default: number of CPUs)")
+    arg_parser.add_argument('--from', dest='first_date', default=None,
+                            help="Only convert the messages from this day on (YYYY-MM-DD)")
+    arg_parser.add_argument('--to', dest='last_date', default=None,
+                            help="Only convert the messages up to and including this day (YYYY-MM-DD)")
+    arg_parser.add_argument('--sender', action='append', default=None,
+                            help="Only convert the messages of this user id, can be given several times")
+    arg_parser.add_argument('--preview', action='store_true',
+                            help="Draw a quick preview of the chat directly to PDF instead of writing LaTeX files")
+    arg_parser.add_argument('--external-decoders', action='store_true',
+                            help="Convert stickers with dwebp and videos with ffmpeg instead of in process")
+    arg_parser.add_argument('--no-index', action='store_true',
+                            help="Don't keep the message index bc2-index.bin next to the exported chat")
+    arg_parser.add_argument('--render-jobs', type=int, default=1,
+                            help="Number of processes rendering the messages into LaTeX, 0 for one per CPU (default: 1)")
     args = arg_parser.parse_args()
 
     bc = BubbleCreator()
+    bc.media.workers = args.jobs
+    bc.use_media_cache = not args.no_cache
+    bc.media_cache_size = args.cache_size << 20
+    bc.max_message_per_file = args.messages_per_file
+    bc.compile_jobs = args.compile_jobs
+    bc.render_jobs = args.render_jobs or None
+    bc.photo_dpi = args.photo_dpi
+    bc.use_format = not args.no_format
+    bc.self_user_id = args.self_id
+    bc.use_index_file = not args.no_index
+    bc.in_process_decoders = not args.external_decoders
+    bc.preview = args.preview
+    bc.senders = args.sender
+    if args.first_date is not None:
+        bc.first_date = datetime.datetime.strptime(args.first_date, '%Y-%m-%d').date()
+    if args.last_date is not None:
+        bc.last_date = datetime.datetime.strptime(args.last_date, '%Y-%m-%d').date()
 
     # source and destination from arguments
     bc.data_path = args.source
     bc.destination_path = args.target
     bc.bg_path = 'bg3.png'
 
-    bc.run(compile=args.autocompile)
\ No newline at end of file
+    if args.batch:
+        bc.run_batch(compile=args.autocompile, incremental=args.incremental, workers=args.batch_jobs)
+    elif args.profile:
+        profile = cProfile.Profile()
+        profile.runcall(bc.run, compile=args.autocompile, incremental=args.incremental)
+        profile.dump_stats(os.path.join(args.target, 'bc2-profile.pstats'))
+    else:
+        bc.run(compile=args.autocompile, incremental=args.incremental)
\ No newline at end of file
@@ -0,0 +1,78 @@
+import array
+import datetime
+
+
+class ChunkLayout(object):
+    # The rendered messages of one LaTeX file, kept in columns: the sender number and the day of every message, and
+    # the LaTeX fragment of every message. Grouping by sender and placing the date bubbles only looks at the arrays,
+    # the fragments are written one by one and never joined.
+    __slots__ = ('sender_ids', 'sender_numbers', 'senders', 'days', 'fragments', 'bad_dates')
+
+    def __init__(self):
+        self.sender_ids = []  # sender number -> user id as in the export
+        self.sender_numbers = {}  # user id -> sender number
+        self.senders = array.array('i')
+        self.days = array.array('i')  # proleptic Gregorian ordinal of the day of the message, 0 if it has no valid date
+        self.fragments = []
+        self.bad_dates = {}  # message number -> date that could not be parsed
+
+    def __len__(self):
+        return len(self.senders)
+
+    def sender_number(self, sender_id):
+        sender = self.sender_numbers.get(sender_id)
+        if sender is None:
+            sender = self.sender_numbers[sender_id] = len(self.sender_ids)
+            self.sender_ids.append(sender_id)
+        return sender
+
+    def add(self, sender_id, date, fragment):
+        sender = self.sender_number(sender_id)
+
+        # the dates of the export are always written like 2015-01-31T08:00:00, so the fast ISO parser is enough
+        try:
+            day = datetime.datetime.fromisoformat(date).toordinal()
+        except (TypeError, ValueError):
+            day = 0
+            self.bad_dates[len(self.senders)] = date
+
+        self.senders.append(sender)
+        self.days.append(day)
+        self.fragments.append(fragment)
+
+    @classmethod
+    def join(cls, layouts):
+        # Puts layouts of consecutive messages into one, e.g. the shards of a file that were rendered in different
+        # processes. Groups and date bubbles are only formed when the joined layout is written, so they continue over
+        # the shard boundaries just as if all messages had been rendered at once.
+        joined = cls()
+        for layout in layouts:
+            numbers = [joined.sender_number(sender_id) for sender_id in layout.sender_ids]
+            for n, date in layout.bad_dates.items():
+                joined.bad_dates[len(joined.senders) + n] = date
+            joined.senders.extend(numbers[sender] for sender in layout.senders)
+            joined.days.extend(layout.days)
+            joined.fragments.extend(layout.fragments)
+        return joined
+
+    def fragment(self, n):
+        return self.fragments[n]
+
+    def date(self, n):
+        # Raises the same error for a message without valid date as parsing it with strptime.
+        if n in self.bad_dates:
+            return datetime.datetime.strptime(str(self.bad_dates[n]), '%Y-%m-%dT%H:%M:%S').date()
+        return datetime.date.fromordinal(self.days[n])
+
+    def groups(self):
+        # Yields (sender id, first, end) for every run of messages by the same sender.
+        senders = self.senders
+        count = len(senders)
+        first = 0
+        while first < count:
+            sender = senders[first]
+            end = first + 1
+            while end < count and senders[end] == sender:
+                end += 1
+            yield self.sender_ids[sender], first, end
+            first = end
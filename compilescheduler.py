@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import hashlib
+import logging
+import subprocess
+import concurrent.futures
+import tqdm
+
+
+class CompileScheduler(object):
+    # Runs pdflatex for several LaTeX files at once. Each job runs in the given working directory instead of changing
+    # the directory of the whole process, can wait for other futures (e.g. the media files it includes) and is run
+    # again as long as LaTeX asks for another pass.
+    rerun_markers = ['Rerun to get', 'Label(s) may have changed']
+
+    def __init__(self, working_directory, max_jobs=None, max_passes=3, command='pdflatex'):
+        self.working_directory = working_directory
+        self.max_jobs = max_jobs or os.cpu_count()
+        self.max_passes = max_passes
+        self.command = command
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_jobs)
+        self.jobs = []
+        self.format_name = None
+
+    def prepare_format(self, format_name, preamble_document):
+        # Dumps the preamble of preamble_document into a format file (format_name.fmt) with mylatexformat, so that the
+        # packages are loaded once instead of once per file. The format is only built again if the preamble changed.
+        # Returns False if the format could not be built.
+        digest = hashlib.sha256(preamble_document.encode('utf-8')).hexdigest()
+        tex_path = os.path.join(self.working_directory, format_name + '.tex')
+        fmt_path = os.path.join(self.working_directory, format_name + '.fmt')
+        digest_path = os.path.join(self.working_directory, format_name + '.sha256')
+
+        if os.path.isfile(fmt_path) and os.path.isfile(digest_path):
+            with open(digest_path, 'r') as f:
+                if f.read().strip() == digest:
+                    logging.debug('Reusing format {}'.format(fmt_path))
+                    self.format_name = format_name
+                    return True
+
+        with open(tex_path, 'w') as f:
+            f.write(preamble_document)
+        start = time.perf_counter()
+        try:
+            return_code = subprocess.run([self.command, '-ini', '-interaction=nonstopmode', '-jobname=' + format_name,
+                                          '&' + self.command, 'mylatexformat.ltx', format_name + '.tex'],
+                                         cwd=self.working_directory, stdin=subprocess.DEVNULL,
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+        except OSError as e:
+            logging.error('Could not run {}: {}'.format(self.command, e))
+            return False
+        if return_code != 0 or not os.path.isfile(fmt_path):
+            logging.warning('Could not build format {} (exit status {}), compiling without it.'.format(
+                fmt_path, return_code))
+            return False
+
+        logging.debug('Built format {} in {:.1f} s'.format(fmt_path, time.perf_counter() - start))
+        with open(digest_path, 'w') as f:
+            f.write(digest)
+        self.format_name = format_name
+        return True
+
+    def submit(self, tex_file_name, wait_for=()):
+        future = self.executor.submit(self.compile, tex_file_name, list(wait_for))
+        self.jobs.append(future)
+        return future
+
+    def needs_rerun(self, tex_file_name):
+        log_path = os.path.join(self.working_directory, tex_file_name[:-4] + '.log')
+        if not os.path.isfile(log_path):
+            return False
+        with open(log_path, 'r', errors='replace') as f:
+            log = f.read()
+        return any(marker in log for marker in self.rerun_markers)
+
+    def compile(self, tex_file_name, wait_for):
+        concurrent.futures.wait(wait_for)
+
+        start = time.perf_counter()
+        passes = 0
+        return_code = None
+        command = [self.command, '-interaction=nonstopmode', tex_file_name]
+        if self.format_name is not None:
+            command.insert(1, '-fmt=' + self.format_name)
+        while passes < self.max_passes:
+            passes += 1
+            return_code = subprocess.run(command, cwd=self.working_directory, stdin=subprocess.DEVNULL,
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+            if return_code != 0 or not self.needs_rerun(tex_file_name):
+                break
+
+        return {
+            'file': tex_file_name,
+            'return_code': return_code,
+            'passes': passes,
+            'seconds': time.perf_counter() - start
+        }
+
+    def finish(self):
+        # Waits for all jobs and reports time and exit status per file.
+        results = []
+        for future in tqdm.tqdm(concurrent.futures.as_completed(self.jobs), total=len(self.jobs),
+                                desc='Step 2 (Compiling)', file=sys.stdout):
+            try:
+                results.append(future.result())
+            except OSError as e:
+                logging.error('Could not run {}: {}'.format(self.command, e))
+        self.executor.shutdown()
+        self.jobs = []
+
+        results.sort(key=lambda r: r['file'])
+        for r in results:
+            status = 'ok' if r['return_code'] == 0 else 'failed (exit status {})'.format(r['return_code'])
+            print('{}: {}, {} pass(es), {:.1f} s'.format(r['file'], status, r['passes'], r['seconds']))
+        failed = [r for r in results if r['return_code'] != 0]
+        if failed:
+            logging.warning('{} of {} files could not be compiled.'.format(len(failed), len(results)))
+        return results
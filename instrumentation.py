@@ -0,0 +1,71 @@
+import json
+import time
+import contextlib
+
+
+class Stats(object):
+    # Collects timers and counters while converting a chat. Timers add up the wall time of all calls with the same
+    # name and count the calls. Timers may be nested, e.g. the time of 'emoji_scan' is also part of the time of
+    # 'process_message.*'.
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.tables = {}  # named counters per key, e.g. the occurrences of every emoji
+        self.started = time.time()
+
+    def add_time(self, name, seconds, calls=1):
+        timer = self.timers.setdefault(name, [0.0, 0])
+        timer[0] += seconds
+        timer[1] += calls
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed_iter(self, name, iterable):
+        # times how long it takes to produce the items of an iterable, e.g. reading messages from the JSON file
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - start, 0)
+                return
+            self.add_time(name, time.perf_counter() - start)
+            yield item
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def count_in(self, table, key, n=1):
+        counters = self.tables.setdefault(table, {})
+        counters[key] = counters.get(key, 0) + n
+
+    def merge(self, other):
+        # adds the timers, counters and tables of another Stats, e.g. of a worker process
+        for name, (seconds, calls) in other.timers.items():
+            self.add_time(name, seconds, calls)
+        for name, n in other.counters.items():
+            self.count(name, n)
+        for table, counters in other.tables.items():
+            for key, n in counters.items():
+                self.count_in(table, key, n)
+
+    def report(self):
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'timers': {name: {'seconds': round(seconds, 6), 'calls': calls}
+                       for name, (seconds, calls) in sorted(self.timers.items())},
+            'counters': dict(sorted(self.counters.items())),
+            'tables': {name: dict(sorted(counters.items(), key=lambda item: -item[1]))
+                       for name, counters in sorted(self.tables.items())}
+        }
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
@@ -0,0 +1,211 @@
+import codecs
+import json
+import re
+
+# Incremental reading of large JSON files. Only the array that is asked for is iterated, one element at a time, so
+# memory usage is bounded by the largest single element and not by the size of the file.
+
+whitespace = re.compile(r'[ \t\n\r]*')
+# everything up to the next bracket that is not part of a string, written without nested repetitions so that a string
+# cut off at the end of the buffer doesn't make the pattern backtrack
+no_brackets = re.compile(r'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*')
+
+
+class StreamReader(object):
+    def __init__(self, f, chunk_size=1 << 20, start=0, track_offsets=False):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+        # byte offset of self.pos in the file, only kept up to date if track_offsets is set
+        self.track_offsets = track_offsets
+        self.byte_pos = start
+
+    def read_more(self):
+        if self.eof:
+            return False
+
+        # drop the part of the buffer that has already been consumed
+        if self.pos > self.chunk_size:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+
+        # read at least as much as is already buffered, so that re-parsing a large element stays linear overall
+        data = self.f.read(max(self.chunk_size, len(self.buffer)))
+        if not data:
+            self.eof = True
+            self.buffer += self.decoder.decode(b'', final=True)
+        else:
+            self.buffer += self.decoder.decode(data)
+        return True
+
+    def advance(self, new_pos):
+        if self.track_offsets:
+            self.byte_pos += len(self.buffer[self.pos:new_pos].encode('utf-8'))
+        self.pos = new_pos
+
+    def peek(self):
+        # returns the next non-whitespace character without consuming it, or '' at the end of the file
+        while True:
+            self.advance(whitespace.match(self.buffer, self.pos).end())
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read_more():
+                return ''
+
+    def expect(self, character):
+        found = self.peek()
+        if found != character:
+            raise ValueError('Expected {!r} but found {!r} at byte {}'.format(character, found, self.byte_pos))
+        self.advance(self.pos + 1)
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # the value might just be cut off at the end of the buffer
+                if self.read_more():
+                    continue
+                raise
+            # a number at the end of the buffer might continue in the next chunk
+            if end == len(self.buffer) and self.read_more():
+                continue
+            self.advance(end)
+            return obj
+
+    def skip(self):
+        # consumes the next value without decoding it: only the brackets outside of strings are counted
+        if self.peek() not in '[{':
+            self.value()
+            return
+        depth = 0
+        buffer, pos = self.buffer, self.pos
+        while True:
+            end = no_brackets.match(buffer, pos).end()
+            if end == len(buffer) or buffer[end] == '"':
+                # the buffer ends within the value, maybe within a string
+                self.advance(end)
+                if not self.read_more():
+                    raise ValueError('Unexpected end of file at byte {}'.format(self.byte_pos))
+                buffer, pos = self.buffer, self.pos
+                continue
+            pos = end + 1
+            if buffer[end] in '[{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    self.advance(pos)
+                    return
+
+    def members(self, keys):
+        # consumes an object and returns the members with the given keys, the other values are skipped
+        found = {}
+        self.expect('{')
+        if self.peek() == '}':
+            self.advance(self.pos + 1)
+            return found
+        while True:
+            key = self.value()
+            self.expect(':')
+            if key in keys:
+                found[key] = self.value()
+            else:
+                self.skip()
+            if self.peek() == ',':
+                self.advance(self.pos + 1)
+            else:
+                self.expect('}')
+                return found
+
+    def find_key(self, key):
+        # consumes the members of the current object until the value of the given key is next, returns False if the
+        # object does not contain the key
+        self.expect('{')
+        if self.peek() == '}':
+            self.advance(self.pos + 1)
+            return False
+        while True:
+            current_key = self.value()
+            self.expect(':')
+            if current_key == key:
+                return True
+            self.value()
+            if self.peek() == ',':
+                self.advance(self.pos + 1)
+            else:
+                self.expect('}')
+                return False
+
+    def items(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.advance(self.pos + 1)
+            return
+        while True:
+            self.peek()
+            begin = self.byte_pos
+            obj = self.value()
+            yield obj, begin, self.byte_pos
+            if self.peek() == ',':
+                self.advance(self.pos + 1)
+            else:
+                self.expect(']')
+                return
+
+
+def iter_array(file_path, keys=('messages',), start=0, with_offsets=False):
+    # Iterates over the elements of the array found by following the given object keys from the value starting at
+    # byte offset start. With with_offsets, (element, begin, end) tuples with byte offsets in the file are yielded.
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        reader = StreamReader(f, start=start, track_offsets=with_offsets)
+        for key in keys:
+            if not reader.find_key(key):
+                return
+        for obj, begin, end in reader.items():
+            if with_offsets:
+                yield obj, begin, end
+            else:
+                yield obj
+
+
+def iter_members(file_path, keys, members, start=0):
+    # Like iter_array with offsets for an array of objects, but only the given members of each object are decoded:
+    # yields ({member: value}, begin, end) tuples. The other values are skipped without building them.
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        reader = StreamReader(f, start=start, track_offsets=True)
+        for key in keys:
+            if not reader.find_key(key):
+                return
+        reader.expect('[')
+        if reader.peek() == ']':
+            return
+        while True:
+            reader.peek()
+            begin = reader.byte_pos
+            found = reader.members(members)
+            yield found, begin, reader.byte_pos
+            if reader.peek() == ',':
+                reader.advance(reader.pos + 1)
+            else:
+                reader.expect(']')
+                return
+
+
+def read_value(file_path, keys, start=0):
+    # Returns the value found by following the given object keys, or None if one of them is missing.
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        reader = StreamReader(f, start=start)
+        for key in keys:
+            if not reader.find_key(key):
+                return None
+        return reader.value()
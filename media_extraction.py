@@ -0,0 +1,94 @@
+import os.path
+import logging
+import subprocess
+
+# Converters for the media files of a chat. All of them take the source file and the exact target file, so they
+# can be run in worker processes while the message text already refers to the target file.
+# The libraries are only imported by the converters that need them (ampimage alone loads numpy, pyogg and
+# reportlab), so a chat without media doesn't load any of them.
+
+
+def voice_graph_path(source_path, target_folder):
+    # the file ogg_to_pdf creates for a voice message
+    return os.path.join(target_folder, os.path.basename(source_path)[:-3] + 'pdf')
+
+
+# number of bars and how their height is measured, see ampimage.envelope
+voice_graph_params = {'bars': 48, 'mode': 'rms'}
+
+
+def voice_graph(source_path, target_path, bars=48, mode='rms'):
+    from ampimage import ogg_to_pdf
+    result_path = ogg_to_pdf(source_path, os.path.dirname(target_path), bars, mode)
+    if result_path is None:
+        raise ValueError('{} is not an OGG file'.format(source_path))
+    return result_path
+
+
+def webp_to_png(source_path, target_path):
+    # Sticker thumbnails are in WEBP format (despite the file ending). They are decoded in process with Pillow, only
+    # if that fails (e.g. Pillow was built without WEBP support) the dwebp program is started.
+    from PIL import Image, features
+    if features.check('webp'):
+        try:
+            with Image.open(source_path) as image:
+                image.save(target_path, 'PNG')
+            return target_path
+        except OSError as e:
+            logging.debug('Pillow could not decode {}, trying dwebp: {}'.format(source_path, e))
+    return dwebp_to_png(source_path, target_path)
+
+
+def dwebp_to_png(source_path, target_path):
+    # the arguments are passed without a shell, so any file name works
+    from webptools.webpbin import getdwebp
+    result = subprocess.run([getdwebp(None), source_path, '-o', target_path], stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    logging.debug(result.stdout.decode(errors='replace'))
+    if result.returncode != 0 or not os.path.isfile(target_path):
+        raise RuntimeError('dwebp could not convert {}'.format(source_path))
+    return target_path
+
+
+def keyframe_from_video(source_path, target_path):
+    # Takes the first keyframe of the video as thumbnail. With PyAV, only the packets up to that keyframe are decoded
+    # in process, otherwise (or if PyAV can't read the file) ffmpeg is started.
+    try:
+        import av
+    except ImportError:
+        av = None
+    if av is not None:
+        try:
+            with av.open(source_path) as container:
+                stream = container.streams.video[0]
+                stream.codec_context.skip_frame = 'NONKEY'
+                for frame in container.decode(stream):
+                    frame.to_image().save(target_path)
+                    return target_path
+        except Exception as e:  # PyAV raises its own errors for every kind of broken file
+            logging.debug('PyAV could not decode {}, trying ffmpeg: {}'.format(source_path, e))
+    return thumbnail_from_video(source_path, target_path)
+
+
+def thumbnail_from_video(source_path, target_path):
+    # takes the first frame of the video as thumbnail
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-i', source_path, '-frames:v', '1', target_path],
+                   check=True, stdin=subprocess.DEVNULL)
+    return target_path
+
+
+def downscale_image(source_path, target_path, max_width=1500, quality=85):
+    # Scales the image down to at most max_width pixels and compresses it again. PNG files stay PNG (they might be
+    # transparent), everything else becomes JPEG.
+    from PIL import Image, ImageOps
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.width > max_width:
+            image = image.resize((max_width, max(1, round(image.height * max_width / image.width))), Image.LANCZOS)
+        if target_path.lower().endswith('.png'):
+            image.save(target_path, 'PNG', optimize=True)
+        else:
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.save(target_path, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return target_path
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class MediaCache(object):
+    # Persistent cache for converted media files. Entries are keyed by the content of the source file and the
+    # converter (plus its parameters), so renamed or repeated files are only converted once. If the cache grows
+    # beyond max_size bytes, the least recently used entries are removed. The digests of the source files are kept
+    # with their size and modification time, so a source is only read again when it has changed.
+    index_file_name = 'index.json'
+    digests_file_name = 'digests.json'
+
+    def __init__(self, path, max_size=1 << 30):
+        self.path = path
+        self.max_size = max_size
+        self.index = {}
+        self.digests = {}  # absolute source path -> [size, mtime_ns, SHA-256 of the content]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        index_path = os.path.join(self.path, self.index_file_name)
+        if os.path.isfile(index_path):
+            try:
+                with open(index_path, 'r') as f:
+                    self.index = json.load(f)
+            except ValueError:
+                logging.warning('Media cache index is damaged, starting with an empty cache.')
+                self.index = {}
+        self.total_size = sum(entry['size'] for entry in self.index.values())
+
+        digests_path = os.path.join(self.path, self.digests_file_name)
+        if os.path.isfile(digests_path):
+            try:
+                with open(digests_path, 'r') as f:
+                    self.digests = json.load(f)
+            except ValueError:
+                logging.warning('Media cache digests are damaged, the sources will be read again.')
+                self.digests = {}
+
+    def source_digest(self, source_path):
+        st = os.stat(source_path)
+        path = os.path.abspath(source_path)
+        entry = self.digests.get(path)
+        if entry is None or entry[0] != st.st_size or entry[1] != st.st_mtime_ns:
+            entry = self.digests[path] = [st.st_size, st.st_mtime_ns, file_digest(source_path)]
+        return entry[2]
+
+    def key(self, converter, source_path, target_path, params=None):
+        h = hashlib.sha256()
+        h.update(self.source_digest(source_path).encode())
+        h.update(converter.__module__.encode() + b'.' + converter.__name__.encode())
+        h.update(os.path.splitext(target_path)[1].encode())
+        h.update(json.dumps(params, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + self.index[key]['extension'])
+
+    def fetch(self, key, target_path):
+        # Copies the cached file to target_path. Returns False if there is no (intact) entry for the key.
+        if key not in self.index or not os.path.isfile(self.entry_path(key)):
+            if key in self.index:
+                self.total_size -= self.index.pop(key)['size']
+            self.misses += 1
+            return False
+        shutil.copyfile(self.entry_path(key), target_path)
+        self.index[key]['used'] = time.time()
+        self.hits += 1
+        return True
+
+    def store(self, key, source_path):
+        if not os.path.isfile(source_path):
+            return
+        if key in self.index:
+            self.total_size -= self.index[key]['size']
+        self.index[key] = {
+            'extension': os.path.splitext(source_path)[1],
+            'size': os.path.getsize(source_path),
+            'used': time.time()
+        }
+        shutil.copyfile(source_path, self.entry_path(key))
+        self.total_size += self.index[key]['size']
+        if self.total_size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        for key in sorted(self.index, key=lambda k: self.index[k]['used']):
+            if self.total_size <= self.max_size:
+                break
+            self.total_size -= self.index[key]['size']
+            entry_path = self.entry_path(key)
+            if os.path.isfile(entry_path):
+                os.remove(entry_path)
+            del self.index[key]
+            self.evictions += 1
+
+    def save(self):
+        index_path = os.path.join(self.path, self.index_file_name)
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(index_path + '.tmp', index_path)
+
+        # the digests of sources that no longer exist are dropped
+        digests_path = os.path.join(self.path, self.digests_file_name)
+        digests = {path: entry for path, entry in self.digests.items() if os.path.isfile(path)}
+        with open(digests_path + '.tmp', 'w') as f:
+            json.dump(digests, f)
+        os.replace(digests_path + '.tmp', digests_path)
+
+    def summary(self):
+        return 'Media cache: {} hits, {} misses, {} evicted, {} entries ({:.1f} MB)'.format(
+            self.hits, self.misses, self.evictions, len(self.index), self.total_size / (1 << 20))
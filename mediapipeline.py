@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import threading
+import concurrent.futures
+import tqdm
+
+
+def run_job(converter, source_path, target_path, params):
+    start_time = time.perf_counter()
+    converter(source_path, target_path, **params)
+    return time.perf_counter() - start_time
+
+
+class MediaPipeline(object):
+    # Runs the media conversions (voice graphs, stickers, video thumbnails) on a process pool while the messages are
+    # converted. The message text only refers to the target files, which are known before the conversion has run.
+    # A target that is submitted again is only written once per run. If a MediaCache is set, converted files are
+    # reused across runs and identical sources are only converted once.
+    # The params are passed to the converter as keyword arguments and are part of the cache key.
+    def __init__(self, workers=None, cache=None, stats=None):
+        self.workers = workers
+        self.cache = cache
+        self.stats = stats
+        self.executor = None
+        self.jobs = []
+        self.pending = {}  # cache key -> the job converting it
+        self.targets = {}  # target path -> the job writing it
+        self.failed_jobs = []
+        self.unclaimed = {}  # target path -> completion future, for the targets submitted since the last claim()
+
+        # the completion callbacks run in a different thread
+        self.lock = threading.Lock()
+
+    def submit(self, converter, source_path, target_path, params=None):
+        with self.lock:
+            # the target is already being written, e.g. for the same sticker in several messages
+            job = self.targets.get(target_path)
+            if job is not None:
+                if self.cache is not None:
+                    self.cache.hits += 1
+                self.unclaimed[target_path] = job['done']
+                return
+
+        key = None
+        if self.cache is not None:
+            try:
+                key = self.cache.key(converter, source_path, target_path, params)
+            except OSError as e:
+                logging.error('Media conversion failed for {}: {}'.format(source_path, e))
+                self.failed_jobs.append((source_path, e))
+                done = concurrent.futures.Future()
+                done.set_exception(e)
+                self.unclaimed[target_path] = done
+                return
+
+            with self.lock:
+                # the same content is already being converted, so we just copy the result
+                if key in self.pending:
+                    job = self.pending[key]
+                    self.cache.hits += 1
+                    if job['done'].done():
+                        if job['done'].exception() is None:
+                            shutil.copyfile(job['target'], target_path)
+                    else:
+                        job['copies'].append(target_path)
+                    self.targets[target_path] = job
+                    self.unclaimed[target_path] = job['done']
+                    return
+                if self.cache.fetch(key, target_path):
+                    # later occurrences of the same target must not copy it again, it might already be in use
+                    done = concurrent.futures.Future()
+                    done.set_result(target_path)
+                    self.targets[target_path] = {'source': source_path, 'target': target_path, 'key': key,
+                                                 'copies': [], 'done': done}
+                    self.unclaimed[target_path] = done
+                    return
+
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers or os.cpu_count())
+        job = {
+            'source': source_path,
+            'target': target_path,
+            'key': key,
+            'copies': [],
+            'done': concurrent.futures.Future()  # set when the target file and all copies are in place
+        }
+        self.jobs.append(job)
+        self.unclaimed[target_path] = job['done']
+        with self.lock:
+            self.targets[target_path] = job
+            if key is not None:
+                self.pending[key] = job
+
+        future = self.executor.submit(run_job, converter, source_path, target_path, params or {})
+        future.add_done_callback(lambda f: self.job_done(job, converter.__name__, f))
+
+    def job_done(self, job, converter_name, future):
+        try:
+            seconds = future.result()
+            with self.lock:
+                if self.stats is not None:
+                    self.stats.add_time('media.' + converter_name, seconds)
+                for copy_path in job['copies']:
+                    shutil.copyfile(job['target'], copy_path)
+                if job['key'] is not None:
+                    self.cache.store(job['key'], job['target'])
+                job['done'].set_result(job['target'])
+        except Exception as e:
+            with self.lock:
+                job['done'].set_exception(e)
+
+    def claim(self):
+        # Returns the targets submitted since the last call with their completion futures, e.g. the media of one LaTeX
+        # file. Targets that were already in place are included as well.
+        claimed = self.unclaimed
+        self.unclaimed = {}
+        return claimed
+
+    def finish(self):
+        # Waits for all submitted jobs. Failed jobs are logged and collected, but don't abort the run.
+        for job in tqdm.tqdm(self.jobs, desc='Step 1b (Converting media)', file=sys.stdout):
+            try:
+                job['done'].result()
+            except Exception as e:
+                logging.error('Media conversion failed for {}: {}'.format(job['source'], e))
+                self.failed_jobs.append((job['source'], e))
+
+        if self.failed_jobs:
+            logging.warning('{} media conversions failed.'.format(len(self.failed_jobs)))
+        self.jobs = []
+        self.pending = {}
+        self.targets = {}
+        self.unclaimed = {}
+
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.cache is not None:
+            self.cache.save()
+        return self.failed_jobs
+
+
+class MediaRecorder(object):
+    # Takes the place of a MediaPipeline in a process that only renders messages: the jobs are recorded, so that the
+    # main process can submit them to its pipeline (see BubbleCreator.convert).
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, converter, source_path, target_path, params=None):
+        self.jobs.append((converter, source_path, target_path, params))
+
+    def claim(self):
+        # Returns the jobs recorded since the last call.
+        claimed = self.jobs
+        self.jobs = []
+        return claimed
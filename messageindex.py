@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import array
+import struct
+import logging
+import calendar
+import datetime
+from jsonstream import iter_array
+
+# magic, byte order, size and modification time of the export, offset of the chat, number of messages, size of the
+# JSON footer with the users and message kinds
+header_format = struct.Struct('<8s1sQqQQQ')
+magic = b'BC2IDX01'
+
+
+def date_seconds(date):
+    # The dates of the export have no time zone, they are only compared with each other.
+    try:
+        return calendar.timegm(datetime.datetime.strptime(str(date), '%Y-%m-%dT%H:%M:%S').timetuple())
+    except ValueError:
+        return 0
+
+
+class MessageIndex(object):
+    # Byte offset, length, date, sender and kind of every message of a chat, stored column by column in a binary file
+    # next to the export. With the index, the users are known without reading the chat and a date range or a sender
+    # can be rendered by reading only their messages. The index is built again when the export changes.
+    def __init__(self, json_file_path, messages_start=0):
+        self.json_file_path = json_file_path
+        self.messages_start = messages_start
+        self.offsets = array.array('Q')
+        self.lengths = array.array('I')
+        self.dates = array.array('q')
+        self.senders = array.array('i')  # index into users, -1 for messages without sender
+        self.kinds = array.array('B')  # index into kind_names
+        self.users = []  # [id, name] in the order of their first message
+        self.kind_names = []
+
+    def columns(self):
+        return [self.offsets, self.lengths, self.dates, self.senders, self.kinds]
+
+    def export_signature(self):
+        st = os.stat(self.json_file_path)
+        return st.st_size, st.st_mtime_ns
+
+    def build(self, kind_of):
+        # kind_of gives the kind of a message, e.g. BubbleCreator.message_kind
+        user_numbers = {}
+        kind_numbers = {}
+        for m, begin, end in iter_array(self.json_file_path, ('messages',), start=self.messages_start,
+                                        with_offsets=True):
+            if 'from_id' in m:
+                user_id, user_name = m['from_id'], m.get('from')
+            elif 'actor_id' in m:
+                user_id, user_name = m['actor_id'], m.get('actor')
+            else:
+                user_id = None
+
+            if user_id is None:
+                sender = -1
+            else:
+                sender = user_numbers.get(user_id)
+                if sender is None:
+                    sender = user_numbers[user_id] = len(self.users)
+                    self.users.append([user_id, 'Unknown User' if user_name is None else user_name])
+
+            kind = kind_of(m)
+            kind_number = kind_numbers.get(kind)
+            if kind_number is None:
+                kind_number = kind_numbers[kind] = len(self.kind_names)
+                self.kind_names.append(kind)
+
+            self.offsets.append(begin)
+            self.lengths.append(end - begin)
+            self.dates.append(date_seconds(m.get('date')))
+            self.senders.append(sender)
+            self.kinds.append(kind_number)
+
+    def save(self, path):
+        size, mtime = self.export_signature()
+        footer = json.dumps({'users': self.users, 'kinds': self.kind_names}, ensure_ascii=False).encode('utf-8')
+        with open(path + '.tmp', 'wb') as f:
+            f.write(header_format.pack(magic, sys.byteorder[0].encode(), size, mtime, self.messages_start,
+                                       len(self.offsets), len(footer)))
+            for column in self.columns():
+                column.tofile(f)
+            f.write(footer)
+        os.replace(path + '.tmp', path)
+
+    def load(self, path):
+        # Returns False if there is no index for this version of the export.
+        if not os.path.isfile(path):
+            return False
+        with open(path, 'rb') as f:
+            header = f.read(header_format.size)
+            if len(header) != header_format.size:
+                return False
+            file_magic, byte_order, size, mtime, messages_start, count, footer_size = header_format.unpack(header)
+            if file_magic != magic or byte_order != sys.byteorder[0].encode() \
+                    or (size, mtime) != self.export_signature() or messages_start != self.messages_start:
+                return False
+            try:
+                for column in self.columns():
+                    column.fromfile(f, count)
+                footer = json.loads(f.read(footer_size).decode('utf-8'))
+            except (EOFError, ValueError):
+                logging.warning('Message index {} is damaged.'.format(path))
+                for column in self.columns():
+                    del column[:]
+                return False
+        self.users = footer['users']
+        self.kind_names = footer['kinds']
+        return True
+
+    @classmethod
+    def open(cls, json_file_path, index_path, kind_of, messages_start=0):
+        # Loads the index from index_path, or builds it and saves it there. If index_path is None or can't be
+        # written, the index is only kept in memory.
+        index = cls(json_file_path, messages_start)
+        if index_path is not None and index.load(index_path):
+            logging.debug('Using message index {}'.format(index_path))
+            return index
+
+        index.build(kind_of)
+        if index_path is not None:
+            try:
+                index.save(index_path)
+                logging.debug('Message index written to {}'.format(index_path))
+            except OSError as e:
+                logging.warning('Could not write message index {}: {}'.format(index_path, e))
+        return index
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def select(self, first_date=None, last_date=None, senders=None):
+        # Numbers of the messages from first_date to last_date (datetime.date, both included) whose sender is one of
+        # the given user ids. None means no limit.
+        first = None if first_date is None else calendar.timegm(first_date.timetuple())
+        end = None if last_date is None else calendar.timegm((last_date + datetime.timedelta(days=1)).timetuple())
+        sender_numbers = None
+        if senders is not None:
+            sender_numbers = set(i for i, (user_id, name) in enumerate(self.users) if user_id in senders)
+
+        selected = []
+        dates = self.dates
+        for n in range(len(dates)):
+            if first is not None and dates[n] < first:
+                continue
+            if end is not None and dates[n] >= end:
+                continue
+            if sender_numbers is not None and self.senders[n] not in sender_numbers:
+                continue
+            selected.append(n)
+        return selected
+
+    def iter_messages(self, numbers):
+        # Reads only the given messages from the export.
+        with open(self.json_file_path, 'rb') as f:
+            for n in numbers:
+                f.seek(self.offsets[n])
+                yield json.loads(f.read(self.lengths[n]))
@@ -0,0 +1,252 @@
+import os
+import logging
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+# Draws a chat straight into a PDF file with reportlab, as a quick preview that doesn't need LaTeX. The layout only
+# roughly follows template.tex: one column, the bubbles of a sender grouped, date bubbles between the days.
+
+page_width, page_height = A4
+margin = 2 * cm
+text_width = page_width - 2 * margin
+
+font_name = 'Vera'  # Bitstream Vera comes with reportlab and covers more than Latin-1, unlike the standard fonts
+bold_font_name = 'VeraBd'
+font_size = 10
+leading = 13
+small_size = 7
+small_leading = 9
+emoji_size = 12
+
+padding = 5
+bubble_ratio = .6  # maximal bubble width as a share of the text width
+bubble_sep = 2  # between the bubbles of a group
+group_sep = 8  # between two groups
+max_image_height = page_height / 3
+
+# the colors of template.tex
+bubble_blue = (65 / 255, 159 / 255, 217 / 255)
+bubble_gray = (241 / 255, 240 / 255, 240 / 255)
+date_background = (76 / 255, 145 / 255, 191 / 255)
+
+fonts_registered = False
+
+
+def register_fonts():
+    global fonts_registered
+    if not fonts_registered:
+        pdfmetrics.registerFont(TTFont(font_name, 'Vera.ttf'))
+        pdfmetrics.registerFont(TTFont(bold_font_name, 'VeraBd.ttf'))
+        fonts_registered = True
+
+
+class PreviewRenderer(object):
+    # Lays out the messages one after another and draws them to a reportlab canvas. A message is split into rows
+    # (lines of text, images, the time), which are put on the page one by one, so long messages continue on the next
+    # page. Emojis and images are taken from the files that exist, nothing is converted.
+    def __init__(self, path, emoji_path=None):
+        register_fonts()
+        self.canvas = canvas.Canvas(path, pagesize=A4, pageCompression=1)
+        self.emoji_path = emoji_path  # gives the PNG file of an emoji code or None, e.g. from BubbleCreator
+        self.y = page_height - margin
+        self.pages = 1
+        self.last_day = None
+        self.last_sender = None
+        self.image_sizes = {}
+        self.string_widths = {}
+
+    def new_page(self):
+        self.canvas.showPage()
+        self.pages += 1
+        self.y = page_height - margin
+
+    def image_size(self, path):
+        if path not in self.image_sizes:
+            try:
+                self.image_sizes[path] = ImageReader(path).getSize()
+            except Exception as e:  # reportlab raises different errors for missing and broken images
+                logging.debug('Preview: could not read image {}: {}'.format(path, e))
+                self.image_sizes[path] = None
+        return self.image_sizes[path]
+
+    def string_width(self, text, font, size):
+        # the same words come up again and again, so their widths are cached
+        key = (text, font, size)
+        width = self.string_widths.get(key)
+        if width is None:
+            width = self.string_widths[key] = pdfmetrics.stringWidth(text, font, size)
+        return width
+
+    def wrap(self, runs, width, font=font_name, size=font_size, line_height=leading):
+        # Breaks runs of text (str) and emojis (emoji code, as a one element tuple) into lines of at most width
+        # points. Lines are only broken at spaces and line breaks, words that are longer than a line are split. The
+        # words between two emojis are kept in one item, so that they are drawn at once.
+        rows = []
+        items = []  # [x, text or emoji code] of the current line
+        x = 0
+        space_width = self.string_width(' ', font, size)
+
+        def end_line():
+            rows.append(('line', line_height, items[:], x, font, size))
+            del items[:]
+
+        for run in runs:
+            if isinstance(run, tuple):
+                if x + emoji_size > width and items:
+                    end_line()
+                    x = 0
+                items.append([x, run])
+                x += emoji_size
+                continue
+
+            for p, paragraph in enumerate(run.split('\n')):
+                if p > 0:
+                    end_line()
+                    x = 0
+                for w, word in enumerate(paragraph.split(' ')):
+                    word_width = self.string_width(word, font, size)
+                    if w > 0:
+                        if x + space_width + word_width > width and items:
+                            end_line()
+                            x = 0
+                        else:
+                            # the space stays in the text item, or starts a new one after an emoji
+                            if items and isinstance(items[-1][1], str):
+                                items[-1][1] += ' '
+                            else:
+                                items.append([x, ' '])
+                            x += space_width
+                    elif x + word_width > width and items:
+                        end_line()
+                        x = 0
+                    while word_width > width:
+                        # split a word that doesn't fit into a line at all
+                        end = len(word) - 1
+                        while end > 1 and self.string_width(word[:end], font, size) > width:
+                            end -= 1
+                        items.append([x, word[:end]])
+                        x += self.string_width(word[:end], font, size)
+                        end_line()
+                        x = 0
+                        word = word[end:]
+                        word_width = self.string_width(word, font, size)
+                    if word:
+                        if items and isinstance(items[-1][1], str):
+                            items[-1][1] += word
+                        else:
+                            items.append([x, word])
+                        x += word_width
+        if items or not rows:
+            end_line()
+        return rows
+
+    def image_row(self, path, width):
+        size = self.image_size(path)
+        if size is None:
+            return None
+        w, h = size
+        scale = min(width / w, max_image_height / h)
+        return ('image', h * scale + 2, path, w * scale, h * scale)
+
+    def add_date(self, text):
+        width = pdfmetrics.stringWidth(text, bold_font_name, small_size) + 4 * padding
+        height = small_leading + padding
+        if self.y - height - group_sep < margin:
+            self.new_page()
+        self.y -= group_sep
+        c = self.canvas
+        c.setFillColorRGB(*date_background)
+        c.roundRect((page_width - width) / 2, self.y - height, width, height, height / 2, stroke=0, fill=1)
+        c.setFillColorRGB(1, 1, 1)
+        c.setFont(bold_font_name, small_size)
+        c.drawCentredString(page_width / 2, self.y - height + padding / 2 + 2, text)
+        self.y -= height
+        self.last_sender = None
+
+    def add_message(self, sender, right, day, time, extra, runs, images):
+        # day is shown in a date bubble if it differs from the last one, extra is a small bold line above the text
+        # (e.g. who it was forwarded from), runs are text and emojis, images (path, share of the bubble width) of the
+        # pictures to show.
+        if day != self.last_day:
+            self.add_date(day)
+            self.last_day = day
+
+        inner_width = text_width * bubble_ratio - 2 * padding
+        rows = []
+        if extra:
+            rows += self.wrap([extra], inner_width, bold_font_name, small_size, small_leading)
+        for path, share in images:
+            row = self.image_row(path, inner_width * share)
+            if row is None:
+                rows += self.wrap(['(missing picture: {})'.format(os.path.basename(path))], inner_width)
+            else:
+                rows.append(row)
+        if runs or not rows:
+            rows += self.wrap(runs, inner_width)
+        rows.append(('time', small_leading, time))
+
+        width = 2 * padding + max(
+            [r[3] for r in rows if r[0] == 'line'] + [r[3] for r in rows if r[0] == 'image']
+            + [self.string_width(time, font_name, small_size)])
+        x = margin + text_width - width if right else margin
+        self.y -= bubble_sep if sender == self.last_sender else group_sep
+        self.last_sender = sender
+        self.draw_bubble(rows, x, width, right)
+
+    def draw_bubble(self, rows, x, width, right):
+        # Draws the rows in bubbles, continuing on a new page where the page is full.
+        c = self.canvas
+        i = 0
+        while i < len(rows):
+            available = self.y - margin - 2 * padding
+            if rows[i][1] > available and self.y < page_height - margin:
+                self.new_page()
+                continue
+            end = i
+            height = 0
+            while end < len(rows) and (height + rows[end][1] <= available or end == i):
+                height += rows[end][1]
+                end += 1
+
+            c.setFillColorRGB(*(bubble_blue if right else bubble_gray))
+            c.roundRect(x, self.y - height - 2 * padding, width, height + 2 * padding, 6, stroke=0, fill=1)
+            c.setFillColorRGB(*((1, 1, 1) if right else (0, 0, 0)))
+            y = self.y - padding
+            for row in rows[i:end]:
+                self.draw_row(row, x + padding, y, width - 2 * padding)
+                y -= row[1]
+            self.y -= height + 2 * padding
+            i = end
+            if i < len(rows):
+                self.new_page()
+
+    def draw_row(self, row, x, y, width):
+        c = self.canvas
+        kind = row[0]
+        if kind == 'line':
+            height, items, used, font, size = row[1:]
+            c.setFont(font, size)
+            for dx, item in items:
+                if isinstance(item, tuple):
+                    path = self.emoji_path(item[0]) if self.emoji_path else None
+                    if path is None or self.image_size(path) is None:
+                        c.rect(x + dx + 1, y - height + 3, emoji_size - 2, emoji_size - 2, stroke=1, fill=0)
+                    else:
+                        c.drawImage(path, x + dx, y - height + 2, emoji_size, emoji_size, mask='auto')
+                else:
+                    c.drawString(x + dx, y - height + 3, item)
+        elif kind == 'image':
+            height, path, w, h = row[1:]
+            c.drawImage(path, x, y - h - 1, w, h, mask='auto')
+        elif kind == 'time':
+            c.setFont(font_name, small_size)
+            c.drawRightString(x + width, y - row[1] + 2, row[2])
+
+    def finish(self):
+        # the last page is written by save
+        self.canvas.save()
+        return self.pages
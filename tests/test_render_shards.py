@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# Checks that rendering the messages in parallel shards (BubbleCreator.render_jobs) writes the same LaTeX files as
+# rendering them in the main process.
+#
+# Usage: python -m unittest discover tests  (or python -m pytest tests)
+
+import contextlib
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_path)
+sys.path.insert(0, os.path.join(repo_path, 'benchmarks'))
+
+from bubblecreator import BubbleCreator  # noqa: E402
+from synthetic_export import ExportGenerator  # noqa: E402
+
+
+class RenderShardsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_path = tempfile.mkdtemp(prefix='bc2-test-')
+        cls.export_path = os.path.join(cls.work_path, 'export')
+        ExportGenerator(cls.export_path, {'emoji_density': .2}, seed=4).generate(150)
+
+        # empty placeholder files are enough for the emoji lookup, some emojis are left out on purpose
+        cls.assets_path = os.path.join(cls.work_path, 'assets')
+        os.makedirs(os.path.join(cls.assets_path, 'emoji'))
+        with open(os.path.join(repo_path, 'emoji-codes.json')) as f:
+            codes = sorted(set(json.load(f).values()))
+        for code in codes[::2]:
+            open(os.path.join(cls.assets_path, 'emoji', code.replace('+', '').replace('U', 'u').replace(' ', '')
+                              + '.png'), 'w').close()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_path, ignore_errors=True)
+
+    def convert(self, render_jobs, shard_size=250):
+        # Returns the contents of the LaTeX files and the statistics. The media paths are part of the LaTeX files,
+        # so every run writes to the same folder.
+        destination_path = os.path.join(self.work_path, 'output')
+        shutil.rmtree(destination_path, ignore_errors=True)
+
+        bc = BubbleCreator()
+        bc.data_path = self.export_path
+        bc.destination_path = destination_path
+        bc.assets_path = self.assets_path
+        bc.template_path = os.path.join(repo_path, 'template')
+        bc.emoji_codes_path = os.path.join(repo_path, 'emoji-codes.json')
+        bc.bg_path = None
+        bc.self_user_id = 'user1000001'
+        bc.max_message_per_file = 40
+        bc.use_media_cache = False
+        bc.media.workers = 1
+        bc.render_jobs = render_jobs
+        bc.render_shard_size = shard_size
+
+        logging.disable(logging.CRITICAL)  # e.g. voice messages that can't be converted here
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                bc.run()
+        finally:
+            logging.disable(logging.NOTSET)
+
+        files = {}
+        for name in sorted(os.listdir(destination_path)):
+            if name.endswith('.tex'):
+                with open(os.path.join(destination_path, name), 'rb') as f:
+                    files[name] = f.read()
+        return files, bc.stats
+
+    def test_shards_match_serial_rendering(self):
+        serial, serial_stats = self.convert(render_jobs=1)
+        self.assertEqual(len(serial), 4)
+        self.assertNotIn('render_wait', serial_stats.timers)
+
+        for shard_size in (1, 7):
+            with self.subTest(shard_size=shard_size):
+                sharded, stats = self.convert(render_jobs=2, shard_size=shard_size)
+                self.assertIn('render_wait', stats.timers)  # the render pool was used
+                self.assertEqual(sorted(sharded), sorted(serial))
+                for name in serial:
+                    self.assertEqual(sharded[name], serial[name], name)
+                self.assertEqual(stats.counters['emoji_occurrences'], serial_stats.counters['emoji_occurrences'])
+
+
+if __name__ == '__main__':
+    unittest.main()